@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+集計・インデックス層（Streamlitに依存しない）
+- 学年ビットマスク: 制作物の各行について、対象学年を1つの整数のビットで表す
+  （bit i = grade_cols[i]）。melt を使わずに学年の絞り込み・(トークン, 学年)表を作る
+- グループ集計: キー列を整数コード化し、全指標を1パス（bincount）で求めてグリッドへ直接展開
+- 制作物名索引: ユニークな制作物名だけを検索し、行へはコード配列で展開する
+- 期間の切り出し: 作成日でソート済みの表を二分探索し、連続区間 [lo, hi) を返す
+  （結合側は制作物行の順に並んでいるので、制作物側の区間から二分探索で求める）
+- 集計キューブ: 年度×発刊月×工程×学年ビットごとの加算可能な指標を前計算し、選択時は足し上げる
+  （ヘッダー差分の取り込み時は差分の行だけを足し引きして更新。キューブを作った表の版と合わなければ更新しない）
+- 集計表: 学年別サマリー・発刊月の推移・工程別指標・次回チェック出し状況（画面とバッチで共用）
+"""
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from ingest import MONTH_ORDER, SEI_ROW_COL, join_seisakubutsu, normalize_bool_series
+
+# --- 学年ビットマスク ---
+
+def build_grade_bits(df: pd.DataFrame, grade_cols) -> pd.Series:
+    """行ごとの学年ビットマスク（int64, dfと同じindex）"""
+    if len(grade_cols) > 62:
+        raise ValueError("学年列が多すぎます（最大62列）。")
+    bits = np.zeros(len(df), dtype=np.int64)
+    for i, col in enumerate(grade_cols):
+        flags = normalize_bool_series(df[col]).to_numpy(dtype=bool)
+        bits |= flags.astype(np.int64) << i
+    return pd.Series(bits, index=df.index, name='学年bits')
+
+def grade_mask_of(grade_cols, grades) -> int:
+    """学年名のリストをビットマスクに変換"""
+    mask = 0
+    for g in grades:
+        if g in grade_cols:
+            mask |= 1 << grade_cols.index(g)
+    return mask
+
+def grades_in_mask(grade_cols, mask: int) -> list:
+    """ビットマスクに含まれる学年名（grade_cols順）"""
+    return [g for i, g in enumerate(grade_cols) if (int(mask) >> i) & 1]
+
+def union_mask(bits) -> int:
+    """ビット配列全体の論理和"""
+    bits = np.asarray(bits, dtype=np.int64)
+    return int(np.bitwise_or.reduce(bits)) if len(bits) else 0
+
+def token_grade_bits(tokens, bits) -> pd.Series:
+    """トークン単位の学年ビットマスク（同一トークンの複数行は論理和）"""
+    codes, uniques = pd.factorize(pd.Series(tokens), use_na_sentinel=True)
+    bits = np.asarray(bits, dtype=np.int64)
+    keep = codes >= 0
+    codes, bits = codes[keep], bits[keep]
+    if len(codes) == 0:
+        return pd.Series(dtype=np.int64)
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_codes)) + 1]
+    merged = np.bitwise_or.reduceat(bits[order], starts)
+    return pd.Series(merged, index=uniques[sorted_codes[starts]])
+
+def grade_pairs(tokens, bits, grade_cols) -> pd.DataFrame:
+    """
+    (トークン, 学年) の重複なし対応表。
+    melt → 対象==True → drop_duplicates と同じ内容・並び（学年列順、行の出現順）
+    """
+    tokens = np.asarray(tokens, dtype=object)
+    bits = np.asarray(bits, dtype=np.int64)
+    parts = []
+    for i, g in enumerate(grade_cols):
+        hit = pd.unique(tokens[((bits >> i) & 1).astype(bool)])
+        if len(hit):
+            parts.append(pd.DataFrame({'トークン': hit, '学年': g}))
+    if not parts:
+        return pd.DataFrame(columns=['トークン', '学年'])
+    return pd.concat(parts, ignore_index=True)
+
+# --- 期間の切り出し ---
+
+def date_slice(dates: pd.Series, start, end):
+    """
+    昇順（欠損は末尾）に並んだ日付列で start <= 日付 < end となる行位置の範囲 (lo, hi)。
+    並びは ingest.sort_by_date で読み込み時に保証する。
+    """
+    values = dates.to_numpy()
+    lo_hi = np.searchsorted(values, np.array([pd.Timestamp(start), pd.Timestamp(end)], dtype=values.dtype))
+    return int(lo_hi[0]), int(lo_hi[1])
+
+def linked_slice(merged_df: pd.DataFrame, s_lo: int, s_hi: int):
+    """
+    制作物側の行範囲 [s_lo, s_hi) を参照する結合側の行位置の範囲 (lo, hi)。
+    結合側は制作物行の昇順に並んでいる（ingest.link_header_rows）。
+    """
+    lo_hi = np.searchsorted(merged_df[SEI_ROW_COL].to_numpy(), [s_lo, s_hi])
+    return int(lo_hi[0]), int(lo_hi[1])
+
+# --- 制作物名索引 ---
+
+def build_name_codes(*series):
+    """
+    複数テーブルの制作物名を共通の語彙（ユニーク名）とコード配列に変換する。
+    戻り値: (語彙ndarray, [各テーブルのコード配列（欠損は -1）])
+    """
+    vocab = np.asarray(pd.unique(pd.concat([s.dropna().astype(str) for s in series], ignore_index=True)),
+                       dtype=object)
+    return vocab, [name_codes(vocab, s) for s in series]
+
+def name_codes(vocab, names: pd.Series) -> np.ndarray:
+    """制作物名を語彙上のコード配列にする（欠損・語彙に無い名前は -1）"""
+    return pd.Categorical(names.astype(str).where(names.notna()), categories=pd.Index(vocab)).codes.astype(np.int32)
+
+def match_names(vocab, text: str) -> np.ndarray:
+    """語彙のうち text を含む名前（正規表現ではなく文字列としての部分一致）"""
+    if len(vocab) == 0:
+        return np.zeros(0, dtype=bool)
+    return pd.Series(vocab, dtype=str).str.contains(text, regex=False).to_numpy(dtype=bool)
+
+def rows_matching(codes: np.ndarray, vocab_hit: np.ndarray) -> np.ndarray:
+    """語彙単位の一致を行単位のマスクへ展開（欠損コード -1 は不一致）"""
+    lut = np.append(vocab_hit, False)
+    return lut[codes]
+
+# --- グループ集計 ---
+
+METRIC_COLS = ['総制作物件数', '総工程数', '期限内完了率(%)', '平均チェック者数(人)']
+ONTIME_COLS = {'チェック済み', '修正日_header', '締め切り日'}
+# 結合側の行データの集計（row_source・next_check_table）で使う制作物側の列（ingest.join_seisakubutsu で付ける）
+ROW_ATTR_COLS = ['トークン', '年度', '発刊月', '工程', '締め切り日', 'チェック者数']
+
+def _group_codes(df: pd.DataFrame, keys, levels) -> np.ndarray:
+    """キー列をグリッド上の通し番号に変換（グリッド外・欠損は -1）"""
+    codes = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    for key, lv in zip(keys, levels):
+        if key not in df.columns:
+            return np.full(len(df), -1, dtype=np.int64)
+        c = pd.Categorical(df[key], categories=lv).codes.astype(np.int64)
+        valid &= c >= 0
+        codes = codes * len(lv) + c
+    codes[~valid] = -1
+    return codes
+
+def _first_per_pair(codes: np.ndarray, values: pd.Series) -> np.ndarray:
+    """(グループ, 値) の組ごとに最初の行位置を返す（値の欠損は除外）"""
+    vcodes, vuniq = pd.factorize(values, use_na_sentinel=True)
+    keep = np.flatnonzero((codes >= 0) & (vcodes >= 0))
+    pair = codes[keep] * max(len(vuniq), 1) + vcodes[keep]
+    _, first = np.unique(pair, return_index=True)
+    return keep[first]
+
+def _completion_flags(merged_df: pd.DataFrame):
+    """行ごとの (チェック済み, 期限内に完了) のbool配列（必要列が無ければ全False）"""
+    if not ONTIME_COLS.issubset(merged_df.columns):
+        return np.zeros(len(merged_df), dtype=bool), np.zeros(len(merged_df), dtype=bool)
+    checked = normalize_bool_series(merged_df['チェック済み']).to_numpy(dtype=bool)
+    ontime = checked & (merged_df['修正日_header'] <= merged_df['締め切り日']).fillna(False).to_numpy(dtype=bool)
+    return checked, ontime
+
+def grouped_metrics(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, keys=(), levels=(),
+                    checkers_from: str = 'merged') -> pd.DataFrame:
+    """
+    keys × levels の全組み合わせ（グリッド）について指標を一括計算する。
+    - 総制作物件数 / 総工程数: 制作物側（制作物名のユニーク数 / 行数）
+    - 期限内完了率(%): ヘッダー結合側（チェック済みのうち 修正日_header <= 締め切り日 の割合）
+    - 平均チェック者数(人): checkers_from 側で (グループ, トークン) ごとに1件として平均
+    keys を空にすると全体を1グループとして集計する。欠損はすべて0。
+    """
+    keys, levels = list(keys), [list(lv) for lv in levels]
+    n_groups = int(np.prod([len(lv) for lv in levels])) if keys else 1
+    s_codes = _group_codes(seisakubutsu_df, keys, levels)
+    m_codes = _group_codes(merged_df, keys, levels)
+
+    def count_by(codes, weights=None):
+        sel = codes >= 0
+        w = None if weights is None else np.asarray(weights, dtype=float)[sel]
+        return np.bincount(codes[sel], weights=w, minlength=n_groups)[:n_groups]
+
+    out = {}
+    if '制作物名' in seisakubutsu_df.columns:
+        first = _first_per_pair(s_codes, seisakubutsu_df['制作物名'])
+        out['総制作物件数'] = np.bincount(s_codes[first], minlength=n_groups)[:n_groups]
+    else:
+        out['総制作物件数'] = np.zeros(n_groups, dtype=np.int64)
+    out['総工程数'] = count_by(s_codes).astype(np.int64)
+
+    if ONTIME_COLS.issubset(merged_df.columns):
+        checked, ontime = _completion_flags(merged_df)
+        completed = count_by(m_codes, checked)
+        on_time = count_by(m_codes, ontime)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out['期限内完了率(%)'] = np.where(completed > 0, on_time / completed * 100, 0.0)
+    else:
+        out['期限内完了率(%)'] = np.zeros(n_groups)
+
+    c_df, c_codes = (merged_df, m_codes) if checkers_from == 'merged' else (seisakubutsu_df, s_codes)
+    if {'トークン', 'チェック者数'}.issubset(c_df.columns):
+        first = _first_per_pair(c_codes, c_df['トークン'])
+        n_tokens = np.bincount(c_codes[first], minlength=n_groups)[:n_groups]
+        checker_sum = np.bincount(c_codes[first], weights=c_df['チェック者数'].to_numpy(dtype=float)[first],
+                                  minlength=n_groups)[:n_groups]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out['平均チェック者数(人)'] = np.where(n_tokens > 0, checker_sum / n_tokens, 0.0)
+    else:
+        out['平均チェック者数(人)'] = np.zeros(n_groups)
+
+    return _grid_frame(out, keys, levels, METRIC_COLS)
+
+def _grid_frame(out: dict, keys, levels, columns) -> pd.DataFrame:
+    """グリッド（keys × levels の全組み合わせ）列と指標列を並べた表"""
+    result = pd.DataFrame(out, columns=columns)
+    if keys:
+        grid = pd.MultiIndex.from_product(levels, names=keys).to_frame(index=False)
+        result = pd.concat([grid, result], axis=1)
+    return result
+
+# --- 集計キューブ ---
+# 年度×発刊月×工程×学年ビットの組ごとに加算できる量（行数・完了数・期限内数・チェック者数の合計）を
+# 読み込み時に1回だけ求めておき、年度・発刊月・学年の選択はキューブ行の足し上げで集計する。
+# 制作物名のユニーク数は加算できないため、(組, 制作物名) の重複なし表から和集合として数える。
+CUBE_DIMS = ['年度', '発刊月', '工程']
+CUBE_KEYS = CUBE_DIMS + ['bits']
+
+def _cube_dims(df: pd.DataFrame, bits) -> pd.DataFrame:
+    """キューブの組（CUBE_DIMS + 学年ビット）の列だけの表"""
+    frame = df[CUBE_DIMS].reset_index(drop=True)
+    frame['bits'] = bits
+    return frame
+
+def _cube_rollup(frame: pd.DataFrame) -> pd.DataFrame:
+    """組ごとに足し上げる（どの学年選択にも掛からない bits=0 の行は持たない）"""
+    frame = frame[frame['bits'].to_numpy() != 0]
+    return frame.groupby(CUBE_KEYS, observed=True, dropna=False, sort=False).sum().reset_index()
+
+def _cube_rows(merged_df: pd.DataFrame, bits, sign: int = 1) -> pd.DataFrame:
+    """結合側の行ごとの完了数・期限内数（sign=-1 で差し引く分）"""
+    frame = _cube_dims(merged_df, bits)
+    checked, ontime = _completion_flags(merged_df)
+    frame['completed'] = sign * checked.astype(np.int64)
+    frame['on_time'] = sign * ontime.astype(np.int64)
+    frame['n_tokens'] = 0
+    frame['checker_sum'] = 0.0
+    return frame
+
+def build_cube(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, grade_bits, grade_cols):
+    """
+    集計キューブを作る。grade_bits は seisakubutsu_df と同じ並びの学年ビットマスク。
+    merged_df の制作物行は seisakubutsu_df の行位置を指す（期間で切るときは先頭からの範囲を渡す）。
+    行データの集計と一致させるため、トークンが制作物側で一意（欠損なし）の場合に限って作成し、それ以外は None。
+    （トークンと制作物行が1対1なので、結合側の各トークンは1つの組にだけ属する）
+    """
+    need = set(CUBE_DIMS) | {'トークン', '制作物名'}
+    if not need.issubset(seisakubutsu_df.columns) or SEI_ROW_COL not in merged_df.columns:
+        return None
+    sei_tokens = seisakubutsu_df['トークン']
+    if sei_tokens.isna().any() or not sei_tokens.is_unique:
+        return None
+    sei_bits = np.asarray(grade_bits, dtype=np.int64)
+
+    sei = _cube_dims(seisakubutsu_df, sei_bits)
+    sei['総工程数'] = 1
+    sei['n_tokens'] = 1
+    sei['checker_sum'] = seisakubutsu_df['チェック者数'].to_numpy(dtype=float) \
+        if 'チェック者数' in seisakubutsu_df.columns else 0.0
+
+    names = _cube_dims(seisakubutsu_df, sei_bits)
+    names['name'] = pd.factorize(seisakubutsu_df['制作物名'], use_na_sentinel=True)[0]
+    names = names[(names['name'] >= 0) & (names['bits'] != 0)].drop_duplicates(ignore_index=True)
+
+    rows = merged_df[SEI_ROW_COL].to_numpy()
+    merged = _cube_rows(join_seisakubutsu(merged_df, seisakubutsu_df, CUBE_DIMS + ['締め切り日']), sei_bits[rows])
+    first_of_token = ~pd.Series(rows).duplicated().to_numpy()
+    merged['n_tokens'] = first_of_token.astype(np.int64)
+    merged['checker_sum'] = np.where(first_of_token, sei['checker_sum'].to_numpy(dtype=float)[rows], 0.0) \
+        if 'チェック者数' in seisakubutsu_df.columns else 0.0
+
+    return {'grade_cols': list(grade_cols), 'seisakubutsu': _cube_rollup(sei), 'merged': _cube_rollup(merged),
+            'names': names}
+
+def cube_apply_delta(cube: dict, seisakubutsu_df: pd.DataFrame, grade_bits, delta: dict) -> dict:
+    """
+    ingest.apply_header_delta の差分をキューブへ足し込む（全行から作り直さない）。
+    - 置き換え前の行を差し引き、置き換え後の行と追加行を足す
+    - チェック者数が変わった・結合側に初めて現れたトークンは、制作物側と結合側の checker_sum / n_tokens を補正する
+    build_cube と同じく作成日が欠損の行・制作物は対象外。grade_bits は seisakubutsu_df と同じ並び。
+    """
+    sei_index = pd.Index(seisakubutsu_df['トークン'])
+    sei_bits = np.asarray(grade_bits, dtype=np.int64)
+    sei_dated = seisakubutsu_df['作成日'].notna().to_numpy()
+
+    def rows(df, sign):
+        df = df[sei_dated[df[SEI_ROW_COL].to_numpy()]]
+        return _cube_rows(join_seisakubutsu(df, seisakubutsu_df, CUBE_DIMS + ['締め切り日']),
+                          sei_bits[df[SEI_ROW_COL].to_numpy()], sign)
+
+    tokens = delta['tokens']
+    pos = sei_index.get_indexer(tokens['トークン'])
+    keep = pos >= 0
+    keep[keep] &= sei_dated[pos[keep]]
+    tokens, pos = tokens[keep], pos[keep]
+    was_present = tokens['was_present'].to_numpy(dtype=bool)
+    before = tokens['before'].to_numpy(dtype=float)
+    after = tokens['after'].to_numpy(dtype=float)
+
+    merged_fix = _cube_dims(seisakubutsu_df.iloc[pos], sei_bits[pos])
+    merged_fix['completed'] = 0
+    merged_fix['on_time'] = 0
+    merged_fix['n_tokens'] = (~was_present).astype(np.int64)
+    merged_fix['checker_sum'] = after - np.where(was_present, before, 0.0)
+    sei_fix = _cube_dims(seisakubutsu_df.iloc[pos], sei_bits[pos])
+    sei_fix['総工程数'] = 0
+    sei_fix['n_tokens'] = 0
+    sei_fix['checker_sum'] = after - before
+
+    out = dict(cube)
+    out['merged'] = _cube_rollup(pd.concat([cube['merged'], rows(delta['removed'], -1), rows(delta['replaced'], 1),
+                                            rows(delta['appended'], 1), merged_fix], ignore_index=True))
+    out['seisakubutsu'] = _cube_rollup(pd.concat([cube['seisakubutsu'], sei_fix], ignore_index=True))
+    return out
+
+def build_cube_entry(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, grade_bits, grade_cols,
+                     version=None) -> dict:
+    """
+    期間を全体にしたときの行（作成日が欠損でない行）のキューブと、それが表す範囲・版。
+    戻り値: {'cube': キューブ or None, 'window': (m_lo, m_hi, s_lo, s_hi), 'version': version}
+    version はキューブを作った表の版（読み込みと反映済みの差分の組）で、差分を足し込むときの照合に使う。
+    """
+    s_hi = int(seisakubutsu_df['作成日'].notna().sum())
+    _, m_hi = linked_slice(merged_df, 0, s_hi)
+    cube = build_cube(merged_df.iloc[:m_hi], seisakubutsu_df.iloc[:s_hi], np.asarray(grade_bits)[:s_hi], grade_cols)
+    return {'cube': cube, 'window': (0, m_hi, 0, s_hi), 'version': version}
+
+def cube_entry_apply_delta(entry: dict, merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, grade_bits,
+                           delta: dict, before, after):
+    """
+    build_cube_entry の結果へ差分を足し込み、版を after にする（merged_df / seisakubutsu_df は反映後の表）。
+    キューブの版が差分を当てる前の表の版 before と違えば（読み込み直した表に、反映済みの差分を含む古いキューブが
+    残っている場合など）足し込まずに None を返す。呼び出し側で捨てて作り直す。
+    """
+    if entry.get('version') != before:
+        return None
+    cube = entry['cube']
+    if cube is not None:
+        cube = cube_apply_delta(cube, seisakubutsu_df, grade_bits, delta)
+    _, _, s_lo, s_hi = entry['window']
+    return {'cube': cube, 'window': (*linked_slice(merged_df, s_lo, s_hi), s_lo, s_hi), 'version': after}
+
+def cube_slice(cube: dict, year=None, month=None, grade_mask: int = 0) -> dict:
+    """年度・発刊月（None は全件）と学年ビットマスク（いずれかの学年を含む行）で絞ったキューブ"""
+    out = dict(cube)
+    for name in ('seisakubutsu', 'merged', 'names'):
+        part = cube[name]
+        keep = (part['bits'].to_numpy() & grade_mask) != 0
+        if year is not None:
+            keep &= (part['年度'] == year).to_numpy(dtype=bool, na_value=False)
+        if month is not None:
+            keep &= (part['発刊月'] == month).to_numpy(dtype=bool, na_value=False)
+        out[name] = part[keep]
+    return out
+
+def cube_grades(cube: dict) -> list:
+    """キューブに現れる学年（grade_cols順）"""
+    bits = np.r_[cube['seisakubutsu']['bits'].to_numpy(), cube['merged']['bits'].to_numpy()]
+    return grades_in_mask(cube['grade_cols'], union_mask(bits))
+
+def _expand_grades(part: pd.DataFrame, keys, levels, grade_cols) -> pd.DataFrame:
+    """キーに学年があれば、各行を bits に含まれる学年ごとの行へ展開する"""
+    if '学年' not in keys:
+        return part
+    hits = [part[(part['bits'].to_numpy() & (1 << grade_cols.index(g))) != 0].assign(学年=g)
+            for g in levels[keys.index('学年')] if g in grade_cols]
+    return pd.concat(hits, ignore_index=True) if hits else part.iloc[:0].assign(学年=pd.Series(dtype=object))
+
+def cube_metrics(cube: dict, keys=(), levels=(), checkers_from: str = 'merged') -> pd.DataFrame:
+    """
+    grouped_metrics と同じ形の表をキューブから求める。
+    keys は 学年 と CUBE_DIMS から選ぶ（cube_slice で絞ったキューブを渡す）。
+    """
+    keys, levels = list(keys), [list(lv) for lv in levels]
+    n_groups = int(np.prod([len(lv) for lv in levels])) if keys else 1
+
+    def expand(name):
+        part = _expand_grades(cube[name], keys, levels, cube['grade_cols'])
+        return part, _group_codes(part, keys, levels)
+
+    def sum_by(part, codes, col):
+        sel = codes >= 0
+        return np.bincount(codes[sel], weights=part[col].to_numpy(dtype=float)[sel], minlength=n_groups)[:n_groups]
+
+    out = {}
+    names, n_codes = expand('names')
+    first = _first_per_pair(n_codes, names['name'])
+    out['総制作物件数'] = np.bincount(n_codes[first], minlength=n_groups)[:n_groups]
+
+    sei, s_codes = expand('seisakubutsu')
+    merged, m_codes = expand('merged')
+    out['総工程数'] = sum_by(sei, s_codes, '総工程数').astype(np.int64)
+
+    completed = sum_by(merged, m_codes, 'completed')
+    on_time = sum_by(merged, m_codes, 'on_time')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['期限内完了率(%)'] = np.where(completed > 0, on_time / completed * 100, 0.0)
+
+    c_part, c_codes = (merged, m_codes) if checkers_from == 'merged' else (sei, s_codes)
+    n_tokens = sum_by(c_part, c_codes, 'n_tokens')
+    checker_sum = sum_by(c_part, c_codes, 'checker_sum')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['平均チェック者数(人)'] = np.where(n_tokens > 0, checker_sum / n_tokens, 0.0)
+
+    return _grid_frame(out, keys, levels, METRIC_COLS)
+
+# --- 集計表（画面・バッチ共通） ---
+# 集計元は {'grades': 学年リスト, 'metrics': grouped_metrics と同じ引数・戻り値の関数} の辞書。
+# 行データからは row_source、キューブからは cube_source で作る。
+SUMMARY_COLS = ['学年', '総制作物件数', '総工程数', '期限内完了率(%)', '平均チェック者数(人)']
+NEXT_CHECK_COLS = ['学年', '次回チェック出し要_人数', '次回チェック出し要_割合(%)']
+
+def row_source(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, relevant_grades: pd.DataFrame) -> dict:
+    """絞り込み済みの行データを集計元にする（学年は (トークン, 学年) 表との結合で付与）"""
+    merged_with_grade = pd.merge(merged_df, relevant_grades, on='トークン', how='left')
+    seisakubutsu_with_grade = pd.merge(seisakubutsu_df, relevant_grades, on='トークン', how='left')
+
+    def metrics(keys=(), levels=(), checkers_from='merged'):
+        if '学年' in keys:
+            return grouped_metrics(merged_with_grade, seisakubutsu_with_grade, keys, levels, checkers_from)
+        return grouped_metrics(merged_df, seisakubutsu_df, keys, levels, checkers_from)
+
+    grades = sorted(set(seisakubutsu_with_grade['学年'].dropna()) | set(merged_with_grade['学年'].dropna()))
+    return {'grades': grades, 'metrics': metrics}
+
+def cube_source(cube: dict) -> dict:
+    """cube_slice で絞ったキューブを集計元にする"""
+    return {'grades': sorted(cube_grades(cube)), 'metrics': partial(cube_metrics, cube)}
+
+def summary_table(source: dict) -> pd.DataFrame:
+    """学年別サマリー（学年ごとの行 + 合計行）"""
+    by_grade = source['metrics'](keys=['学年'], levels=[source['grades']], checkers_from='seisakubutsu')
+    total = source['metrics'](checkers_from='seisakubutsu')
+    total.insert(0, '学年', '合計')
+    summary = pd.concat([by_grade, total], ignore_index=True)
+    for col in ['総制作物件数', '総工程数']:
+        summary[col] = summary[col].astype(int)
+    return summary[SUMMARY_COLS].round(1)
+
+def monthly_table(source: dict) -> pd.DataFrame:
+    """発刊月ごとの制作物件数・総工程数（学年ごと + 合計。データのある月のみ・その他は除く）"""
+    parts = []
+    for keys, levels in ((['発刊月', '学年'], [MONTH_ORDER, source['grades']]), (['発刊月'], [MONTH_ORDER])):
+        part = source['metrics'](keys=keys, levels=levels)
+        part = part[part['総工程数'] > 0].rename(columns={'総制作物件数': '制作物件数'})
+        parts.append(part[keys + ['制作物件数', '総工程数']].reset_index(drop=True))
+    parts[1]['学年'] = '合計'
+    monthly = pd.concat(parts, ignore_index=True)
+    monthly['発刊月'] = pd.Categorical(monthly['発刊月'], categories=MONTH_ORDER, ordered=True)
+    return monthly[monthly['発刊月'] != 'その他'].copy().sort_values('発刊月')
+
+def performance_table(source: dict, grades, processes) -> pd.DataFrame:
+    """学年×工程の総工程数・期限内完了率・平均チェック者数（該当なしは0）"""
+    performance = source['metrics'](keys=['学年', '工程'], levels=[list(grades), list(processes)])
+    performance = performance.drop(columns=['総制作物件数']).round(1)
+    performance['学年'] = pd.Categorical(performance['学年'], categories=list(grades), ordered=True)
+    performance['工程'] = pd.Categorical(performance['工程'], categories=list(processes), ordered=True)
+    return performance
+
+def next_check_table(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, seisakubutsu_bits,
+                     grade_cols, grades) -> pd.DataFrame:
+    """
+    1工程分の行データから、学年ごとの「次回チェック出し」要の人数と割合を求める。
+    seisakubutsu_bits は seisakubutsu_df と同じ並びの学年ビットマスク。該当行のない学年は含めない。
+    """
+    if '次回チェック出し' not in merged_df.columns or seisakubutsu_df.empty:
+        return pd.DataFrame(columns=NEXT_CHECK_COLS)
+    # 制作物行からトークン→学年ビットを引き、ヘッダー行へ配る（melt・mergeなし）
+    token_bits = token_grade_bits(seisakubutsu_df['トークン'], seisakubutsu_bits)
+    pos = token_bits.index.get_indexer(merged_df['トークン'])
+    row_bits = np.where(pos >= 0, token_bits.to_numpy()[pos], 0)
+    next_mask = normalize_bool_series(merged_df['次回チェック出し']).to_numpy(dtype=bool)
+    rows = []
+    for g in grades:
+        in_grade = (row_bits & grade_mask_of(grade_cols, [g])) != 0
+        total_in_group = int(in_grade.sum())
+        if total_in_group == 0:
+            continue
+        count = int((next_mask & in_grade).sum())
+        rows.append({'学年': g, '次回チェック出し要_人数': count,
+                     '次回チェック出し要_割合(%)': round(count / total_in_group * 100, 1)})
+    result = pd.DataFrame(rows, columns=NEXT_CHECK_COLS)
+    if not result.empty:
+        result['次回チェック出し要_人数'] = result['次回チェック出し要_人数'].astype(int)
+        result['学年'] = pd.Categorical(result['学年'], categories=list(grades), ordered=True)
+        result = result.sort_values(by='学年')
+    return result
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+フラグ列のbool正規化ベンチマーク（Series.map(to_bool_like) と normalize_bool_series の比較）
+
+    python benchmarks/bench_bool_normalize.py [セル数]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest import normalize_bool_series, to_bool_like  # noqa: E402
+
+def best_of(fn, repeat=3) -> float:
+    """repeat回実行した最短時間（秒）"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def main(n_cells: int = 1_000_000):
+    rng = np.random.default_rng(0)
+    values = np.array(['TRUE', 'FALSE', '○', '✓', '1', '0', '', None, 'yes'], dtype=object)
+    s = pd.Series(rng.choice(values, size=n_cells), dtype=object)
+
+    expected = s.map(to_bool_like)
+    actual = normalize_bool_series(s).astype(bool)
+    assert (expected.astype(bool) == actual).all(), "結果が一致しません"
+
+    t_map = best_of(lambda: s.map(to_bool_like))
+    t_vec = best_of(lambda: normalize_bool_series(s))
+    print(f"cells={n_cells:,}")
+    print(f"map(to_bool_like)      : {t_map * 1000:8.1f} ms")
+    print(f"normalize_bool_series  : {t_vec * 1000:8.1f} ms")
+    print(f"speedup                : {t_map / t_vec:8.1f} x")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+フィルター処理のピークメモリ比較ベンチマーク
+合成データ（benchmarks/synth.py）を画面と同じ load_tables で読み込み、フィルターに掛かるメモリを比べる。
+- chain: 全件結合した表を 期間→年度/発刊月→学年→制作物名 の各段階で .copy() する旧方式
+- mask : 画面と同じ関数（date_slice・linked_slice・grade_pairs・grade_mask_of・match_names・rows_matching）で
+         制作物側の1本のブールマスクへ合成し、最後に1回だけ取り出して join_seisakubutsu で列を付ける現方式
+  （学年ビットマスク・制作物名の索引は画面ではデータセットごとに1回だけ作るので、計測の前に作っておく）
+計測はフィルターの間だけ tracemalloc を有効にし、開始時点からのピーク増分を見る（読み込みのピークに隠れない）。
+時間は tracemalloc を無効にした別の実行で測る。各方式は別プロセスで実行する。
+
+    python benchmarks/bench_filter_memory.py [行数]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from analytics import (ROW_ATTR_COLS, build_grade_bits, build_name_codes, date_slice, grade_mask_of,  # noqa: E402
+                       grade_pairs, linked_slice, match_names, rows_matching)
+from ingest import SEI_ROW_COL, is_grade_col, join_seisakubutsu, load_tables  # noqa: E402
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'bpr_bench_data')  # bench_pipeline.py と共用
+NAME_TEXT = '1'
+
+def filter_chain(joined, start, end, year, month, tokens, name):
+    """旧方式: 段階ごとに DataFrame を作ってコピーする"""
+    by_date = joined[(joined['作成日_seisakubutsu'] >= start) & (joined['作成日_seisakubutsu'] < end)].copy()
+    by_month = by_date.copy()
+    by_month = by_month[by_month['年度'] == year]
+    by_month = by_month[by_month['発刊月'] == month]
+    filtered = by_month[by_month['トークン'].isin(tokens)].copy()
+    filtered = filtered[filtered['制作物名'].astype(str).str.contains(name, na=False, regex=False)].copy()
+    return filtered
+
+def filter_mask(merged_df, seisakubutsu_df, start, end, year, month, grade_cols, grade_bits, name_index, name):
+    """現方式: main.py のフィルターと同じ関数・順序で制作物側のマスクを作り、最後に1回だけ取り出す"""
+    s_lo, s_hi = date_slice(seisakubutsu_df['作成日'], start, end)
+    m_lo, m_hi = linked_slice(merged_df, s_lo, s_hi)
+    merged_win, sei_win = merged_df.iloc[m_lo:m_hi], seisakubutsu_df.iloc[s_lo:s_hi]
+    sei_mask = np.ones(s_hi - s_lo, dtype=bool)
+    sei_mask &= (sei_win['年度'] == year).to_numpy(dtype=bool, na_value=False, copy=True)
+    sei_mask &= (sei_win['発刊月'] == month).to_numpy(dtype=bool, na_value=False, copy=True)
+    month_tokens = sei_win['トークン'].to_numpy()[sei_mask]
+    month_bits = grade_bits[s_lo:s_hi][sei_mask]
+    grade_pairs(month_tokens, month_bits, grade_cols)
+    selected_tokens = pd.unique(month_tokens[(month_bits & grade_mask_of(grade_cols, grade_cols)) != 0])
+    sei_mask &= sei_win['トークン'].isin(selected_tokens).to_numpy(dtype=bool)
+    sei_mask &= rows_matching(name_index['sei_codes'][s_lo:s_hi], match_names(name_index['vocab'], name))
+    merged_mask = sei_mask[merged_win[SEI_ROW_COL].to_numpy() - s_lo]
+    return join_seisakubutsu(merged_win[merged_mask], seisakubutsu_df, ROW_ATTR_COLS)
+
+def run_child(mode: str, seisakubutsu_path: str, header_path: str):
+    with open(seisakubutsu_path, 'rb') as f:
+        s_data = f.read()
+    with open(header_path, 'rb') as f:
+        h_data = f.read()
+    merged_df, seisakubutsu_df, _, _ = load_tables(s_data, h_data)
+    del s_data, h_data
+    dates = seisakubutsu_df['作成日'].dropna()
+    start, end = dates.quantile(0.25), dates.max() + pd.Timedelta(days=1)
+    year = int(seisakubutsu_df['年度'].max())
+    month = seisakubutsu_df['発刊月'].dropna().iloc[0]
+
+    grade_cols = [c for c in seisakubutsu_df.columns if is_grade_col(c)]
+    grade_bits = build_grade_bits(seisakubutsu_df, grade_cols).to_numpy()
+    if mode == 'chain':
+        # 旧方式は全件結合した表を保持していた（学年は全学年を選んだときと同じトークン）
+        tokens = seisakubutsu_df['トークン'].to_numpy()[grade_bits != 0]
+        joined = join_seisakubutsu(merged_df, seisakubutsu_df)
+        del merged_df, seisakubutsu_df
+        frame_mb = joined.memory_usage(deep=True).sum() / 2**20
+        run = lambda: filter_chain(joined, start, end, year, month, tokens, NAME_TEXT)  # noqa: E731
+    else:
+        vocab, (sei_codes,) = build_name_codes(seisakubutsu_df['制作物名'])
+        name_index = {'vocab': vocab, 'sei_codes': sei_codes}
+        frame_mb = (merged_df.memory_usage(deep=True).sum() + seisakubutsu_df.memory_usage(deep=True).sum()) / 2**20
+        run = lambda: filter_mask(merged_df, seisakubutsu_df, start, end, year, month,  # noqa: E731
+                                  grade_cols, grade_bits, name_index, NAME_TEXT)
+
+    t0 = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - t0
+    del result
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    result = run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{mode:5s}  rows_out={len(result):>9,}  time={elapsed * 1000:8.1f} ms  "
+          f"peak_increase={(peak - base) / 2**20:8.1f} MB  (tables={frame_mb:.1f} MB)")
+
+def main(n_rows: int):
+    from synth import write_dataset
+    paths = write_dataset(n_rows, DATA_DIR)
+    print(f"rows={n_rows:,}")
+    for mode in ('chain', 'mask'):
+        subprocess.run([sys.executable, __file__, '--child', mode, *paths], check=True)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3], sys.argv[4])
+    else:
+        sys.path.insert(0, BENCH_DIR)
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
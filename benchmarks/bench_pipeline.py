@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+ダッシュボード処理のスケーリングベンチマーク
+合成データ（benchmarks/synth.py）を行数ごとに用意し、画面と同じ関数で各段階を計測する。
+- 段階: 読み込み → 期間 → 年度・発刊月・学年フィルター → サマリー/推移 → キューブ → 工程別指標 → 工程タブ → グラフ
+- 計測: 経過時間・対象行数・最大RSS（とその段階での増分）
+- 行数ごとに別プロセスで実行し、結果をJSONに保存（--compare で以前の結果と比較）
+
+    python benchmarks/bench_pipeline.py [--sizes 10000,100000,1000000] [--label 名前] [--compare 以前の結果.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'bpr_bench_data')
+
+def max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def run_child(seisakubutsu_path: str, header_path: str):
+    """1つの行数について全段階を計測し、結果をJSONで標準出力へ書く"""
+    import numpy as np
+    import pandas as pd
+
+    from analytics import (ROW_ATTR_COLS, build_cube, build_grade_bits, cube_slice, cube_source, date_slice,
+                           grade_mask_of, grade_pairs, linked_slice, monthly_table, next_check_table,
+                           performance_table, row_source, summary_table)
+    from charts import monthly_figures, next_check_figure
+    from ingest import PROCESS_ORDER, SEI_ROW_COL, is_grade_col, join_seisakubutsu, load_tables
+
+    stages = []
+
+    def stage(name, fn):
+        before = max_rss_mb()
+        t0 = time.perf_counter()
+        result, rows = fn()
+        stages.append({'stage': name, 'seconds': time.perf_counter() - t0, 'rows': int(rows),
+                       'max_rss_mb': max_rss_mb(), 'rss_increase_mb': max_rss_mb() - before})
+        return result
+
+    def load():
+        with open(seisakubutsu_path, 'rb') as f:
+            s_data = f.read()
+        with open(header_path, 'rb') as f:
+            h_data = f.read()
+        merged_df, seisakubutsu_df, _, _ = load_tables(s_data, h_data)
+        return (merged_df, seisakubutsu_df), len(merged_df)
+    merged_all, sei_all = stage('load', load)
+    grade_cols = [c for c in sei_all.columns if is_grade_col(c)]
+    grade_bits = stage('grade_bits', lambda: (build_grade_bits(sei_all, grade_cols), len(sei_all)))
+
+    # 期間は全体の後半（画面で開始日を動かした場合に相当）
+    def date_filter():
+        dates = sei_all['作成日'].dropna()
+        start, end = dates.quantile(0.5), dates.max() + pd.Timedelta(days=1)
+        s_lo, s_hi = date_slice(sei_all['作成日'], start, end)
+        m_lo, m_hi = linked_slice(merged_all, s_lo, s_hi)
+        return (m_lo, m_hi, s_lo, s_hi), (m_hi - m_lo) + (s_hi - s_lo)
+    m_lo, m_hi, s_lo, s_hi = stage('date_filter', date_filter)
+
+    # 最新年度・全学年（画面の既定に近い条件）
+    year = int(sei_all['年度'].max())
+    def filters():
+        m_win, s_win = merged_all.iloc[m_lo:m_hi], sei_all.iloc[s_lo:s_hi]
+        s_mask = (s_win['年度'] == year).to_numpy(dtype=bool, na_value=False, copy=True)
+        tokens = s_win['トークン'].to_numpy()[s_mask]
+        bits = grade_bits.to_numpy()[s_lo:s_hi][s_mask]
+        relevant_grades = grade_pairs(tokens, bits, grade_cols)
+        selected = pd.unique(tokens[(bits & grade_mask_of(grade_cols, grade_cols)) != 0])
+        s_mask &= s_win['トークン'].isin(selected).to_numpy(dtype=bool)
+        m_mask = s_mask[m_win[SEI_ROW_COL].to_numpy() - s_lo]
+        merged_f = join_seisakubutsu(m_win[m_mask], sei_all, ROW_ATTR_COLS)
+        return (merged_f, s_win[s_mask], relevant_grades), int(m_mask.sum() + s_mask.sum())
+    merged_f, sei_f, relevant_grades = stage('filters', filters)
+
+    def summary():
+        source = row_source(merged_f, sei_f, relevant_grades)
+        return (source, summary_table(source), monthly_table(source)), len(merged_f) + len(sei_f)
+    source, _, monthly = stage('summary', summary)
+
+    def cube():
+        s_hi_all = int(sei_all['作成日'].notna().sum())
+        _, m_hi_all = linked_slice(merged_all, 0, s_hi_all)
+        built = build_cube(merged_all.iloc[:m_hi_all], sei_all.iloc[:s_hi_all],
+                           grade_bits.to_numpy()[:s_hi_all], grade_cols)
+        if built is None:
+            return None, 0
+        sliced = cube_source(cube_slice(built, year=year, grade_mask=grade_mask_of(grade_cols, grade_cols)))
+        summary_table(sliced)
+        monthly_table(sliced)
+        return built, sum(len(built[k]) for k in ('seisakubutsu', 'merged', 'names'))
+    stage('cube_build_and_summary', cube)
+
+    processes = [p for p in PROCESS_ORDER if p in set(merged_f['工程'].dropna().unique())]
+    stage('performance', lambda: (performance_table(source, source['grades'], processes), len(merged_f)))
+
+    def tabs():
+        tables = []
+        s_bits = grade_bits.to_numpy()[s_lo:s_hi]
+        s_pos = np.flatnonzero(sei_all.iloc[s_lo:s_hi].index.isin(sei_f.index))
+        bits_f = s_bits[s_pos]
+        for process in processes:
+            m_in = (merged_f['工程'] == process).to_numpy(dtype=bool, na_value=False)
+            s_in = (sei_f['工程'] == process).to_numpy(dtype=bool, na_value=False)
+            tables.append(next_check_table(merged_f[m_in], sei_f[s_in], bits_f[s_in], grade_cols, source['grades']))
+        return tables, len(merged_f)
+    next_tables = stage('process_tabs', tabs)
+
+    def charts():
+        figures = list(monthly_figures(monthly))
+        for table in next_tables:
+            if not table.empty:
+                figures.append(next_check_figure(table))
+        return [fig.to_json() for fig in figures], len(figures)
+    stage('charts', charts)
+
+    print(json.dumps({'rows': len(merged_all), 'stages': stages}))
+
+def run_size(n_rows: int) -> dict:
+    """合成データを用意し、別プロセスで1つの行数を計測する"""
+    from synth import write_dataset
+    paths = write_dataset(n_rows, DATA_DIR)
+    out = subprocess.run([sys.executable, __file__, '--child', *paths], check=True, capture_output=True, text=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['size'] = n_rows
+    return result
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_result(result: dict, baseline=None):
+    """段階ごとの表。baseline（同じ行数の以前の結果）があれば時間の比も出す"""
+    base = {s['stage']: s for s in baseline['stages']} if baseline else {}
+    print(f"\nsize={result['size']:,}  merged_rows={result['rows']:,}")
+    print(f"{'stage':24s} {'rows':>11s} {'time(ms)':>10s} {'max_rss(MB)':>12s} {'+rss(MB)':>9s}"
+          + (f" {'vs base':>8s}" if base else ''))
+    for s in result['stages']:
+        line = (f"{s['stage']:24s} {s['rows']:>11,} {s['seconds'] * 1000:>10.1f} "
+                f"{s['max_rss_mb']:>12.1f} {s['rss_increase_mb']:>9.1f}")
+        b = base.get(s['stage'])
+        if b and b['seconds'] > 0:
+            line += f" {s['seconds'] / b['seconds']:>7.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="ダッシュボード処理のスケーリングベンチマーク")
+    parser.add_argument('--sizes', default=','.join(str(n) for n in DEFAULT_SIZES),
+                        help="ヘッダー行数のカンマ区切り（例: 10000,100000,1000000,10000000）")
+    parser.add_argument('--label', default=None, help="結果ファイル名（既定: 日時_リビジョン）")
+    parser.add_argument('--compare', default=None, help="比較する以前の結果JSON")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = {r['size']: r for r in json.load(f)['results']}
+    revision = git_revision()
+    results = []
+    for n_rows in [int(n) for n in args.sizes.split(',') if n]:
+        result = run_size(n_rows)
+        print_result(result, baseline.get(n_rows))
+        results.append(result)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    label = args.label or f"{datetime.now():%Y%m%d_%H%M%S}_{revision}"
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'machine': platform.machine(),
+                   'results': results}, f, ensure_ascii=False, indent=1)
+    print(f"\n結果を保存しました: {path}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+ヘッダー差分取り込みの整合チェック
+合成データ（benchmarks/synth.py）のヘッダー一覧を前半と差分に分け、前半を読み込んでから差分を反映した結果が、
+全体を読み込み直した結果と同じ表・集計キューブになることを確かめる。
+続けて画面の再実行（データセットのキャッシュ外れ）と同じく前半を読み込み直して同じ差分をもう一度反映し、
+前の読み込みのキューブ（差分反映済み）には足し込まれず、作り直したキューブが全体と一致することも確かめる。
+- append: ID列の無いCSV（差分は追加のみ。同じ (制作物トークン, 担当者, 作成日) の繰り返しのチェックを含む）
+- id: ヘッダーID列のあるCSV（既存行の変更と追加が混ざった差分）
+不一致があれば終了コード1。
+
+    python benchmarks/check_delta.py [--rows 20000] [--split 15000] [--stream]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from analytics import build_cube_entry, build_grade_bits, cube_entry_apply_delta  # noqa: E402
+from ingest import ROW_KEY_COL, apply_header_delta, is_grade_col, join_seisakubutsu, load_tables  # noqa: E402
+from synth import HEADER_PER_ITEM, generate_header_chunks, generate_seisakubutsu  # noqa: E402
+
+def to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+def comparable(df: pd.DataFrame) -> pd.DataFrame:
+    """行キー（セッションごとのハッシュ）を除き、カテゴリ・整数幅の違いを揃えた表"""
+    df = df.drop(columns=[ROW_KEY_COL], errors='ignore')
+    df = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return df.astype({c: 'int64' for c in df.columns if pd.api.types.is_integer_dtype(df[c])})
+
+def comparable_cube(part: pd.DataFrame) -> pd.DataFrame:
+    """キューブの1表を、差分で足し引きして0になった組を除いて並べ替えた表"""
+    keys = ['年度', '発刊月', '工程', 'bits']
+    values = part.drop(columns=keys).astype(float)
+    part = pd.concat([part[keys].astype({'発刊月': object, '工程': object}), values], axis=1)
+    part = part[values.abs().sum(axis=1).to_numpy() > 0]
+    return part.sort_values(keys, ignore_index=True)
+
+def load_and_apply(seisakubutsu_csv: bytes, base_csv: bytes, delta_csv: bytes, stream: bool, cube_entry=None):
+    """
+    前半を読み込んで差分を反映する（画面の load_data_cached → apply_deltas_cached と同じ流れ）。
+    cube_entry を渡すとそれへ足し込み（版が合わなければ None）、渡さなければ読み込んだ表から作って足し込む。
+    版は (読み込みごとの鍵, 反映済みの差分数)。
+    """
+    state = {}
+    merged_df, seisakubutsu_df, _, _ = load_tables(seisakubutsu_csv, base_csv, stream_header=stream,
+                                                   delta_state=state)
+    grade_cols = [c for c in seisakubutsu_df.columns if is_grade_col(c)]
+    bits = build_grade_bits(seisakubutsu_df, grade_cols).to_numpy()
+    if cube_entry is None:
+        cube_entry = build_cube_entry(merged_df, seisakubutsu_df, bits, grade_cols, (state['hash_key'], 0))
+    merged_df, seisakubutsu_df, delta = apply_header_delta(merged_df, seisakubutsu_df, delta_csv, state)
+    cube_entry = cube_entry_apply_delta(cube_entry, merged_df, seisakubutsu_df, bits, delta,
+                                        (state['hash_key'], 0), (state['hash_key'], 1))
+    return merged_df, seisakubutsu_df, bits, grade_cols, delta, cube_entry
+
+def check(name: str, seisakubutsu_csv: bytes, base_csv: bytes, delta_csv: bytes, full_csv: bytes, stream: bool):
+    full_m, full_s, _, _ = load_tables(seisakubutsu_csv, full_csv)
+    merged_df, seisakubutsu_df, bits, grade_cols, delta, cube_entry = load_and_apply(
+        seisakubutsu_csv, base_csv, delta_csv, stream)
+    cube = cube_entry['cube']
+    stats = delta['stats']
+
+    results = {
+        '結合側': comparable(join_seisakubutsu(merged_df, seisakubutsu_df)).equals(
+            comparable(join_seisakubutsu(full_m, full_s))),
+        '制作物側': comparable(seisakubutsu_df).equals(comparable(full_s)),
+    }
+    full_cube = build_cube_entry(full_m, full_s, build_grade_bits(full_s, grade_cols).to_numpy(), grade_cols)['cube']
+    for part in ('merged', 'seisakubutsu'):
+        results[f"キューブ({part})"] = comparable_cube(cube[part]).equals(comparable_cube(full_cube[part]))
+
+    # 再実行: 読み込み直した表へ同じ差分をもう一度反映する。前のキューブは版が違うので足し込まれず、作り直す
+    merged_df, seisakubutsu_df, bits, _, _, stale = load_and_apply(
+        seisakubutsu_csv, base_csv, delta_csv, stream, cube_entry=cube_entry)
+    results['再実行(古いキューブ)'] = stale is None
+    rebuilt = build_cube_entry(merged_df, seisakubutsu_df, bits, grade_cols)['cube']
+    for part in ('merged', 'seisakubutsu'):
+        results[f"再実行({part})"] = comparable_cube(rebuilt[part]).equals(comparable_cube(full_cube[part]))
+    print(f"[{name}] 置き換え {stats['replaced_rows']:,} 行・追加 {stats['appended_rows']:,} 行 "
+          f"（結合側 {len(merged_df):,} 行 / 全体の読み込み {len(full_m):,} 行）")
+    for label, ok in results.items():
+        print(f"  {label:16s} {'OK' if ok else 'NG'}")
+    return all(results.values())
+
+def main():
+    parser = argparse.ArgumentParser(description="ヘッダー差分取り込みの整合チェック")
+    parser.add_argument('--rows', type=int, default=20_000, help="ヘッダー行数")
+    parser.add_argument('--split', type=int, default=15_000, help="前半（先に読み込む）の行数")
+    parser.add_argument('--stream', action='store_true', help="前半を分割読み込みで読み込む")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    seisakubutsu_df = generate_seisakubutsu(args.rows // HEADER_PER_ITEM, rng)
+    header_df = pd.concat(generate_header_chunks(args.rows, seisakubutsu_df, rng), ignore_index=True)
+    seisakubutsu_csv = to_csv(seisakubutsu_df)
+
+    # ID列なし: 後半をそのまま差分として追加する
+    ok = check('append', seisakubutsu_csv, to_csv(header_df.iloc[:args.split]), to_csv(header_df.iloc[args.split:]),
+               to_csv(header_df), args.stream)
+
+    # ID列あり: 前半の一部の行を変更した版と後半を差分にする（全体は変更後の内容）
+    header_df.insert(0, 'ヘッダーID', pd.Series(np.arange(len(header_df))).map('H{:09d}'.format))
+    base = header_df.iloc[:args.split]
+    changed = base.sample(min(len(base), 500), random_state=0).index
+    updated = header_df.copy()
+    updated.loc[changed, 'チェック済み'] = np.where(updated.loc[changed, 'チェック済み'] == 'TRUE', 'FALSE', 'TRUE')
+    updated.loc[changed, '修正日'] = '2020-01-01 00:00:00'
+    ok &= check('id', seisakubutsu_csv, to_csv(base), to_csv(updated.loc[changed.union(updated.index[args.split:])]),
+                to_csv(updated), args.stream)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
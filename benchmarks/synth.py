@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+合成データ生成（制作物一覧CSV・ヘッダー一覧CSV）
+- 行数はヘッダー一覧の行数。制作物一覧はその1/4（1件あたり平均4件のチェック記録）
+- 工程・発刊月は ingest.PROCESS_ORDER / MONTH_ORDER から、学年フラグは表記ゆれ込みで生成
+- 同じ行数・シードなら同じ内容（ヘッダーは分割して書き出すので1000万行でもメモリは一定）
+
+    python benchmarks/synth.py 行数 [出力先ディレクトリ] [シード] [文字コード]
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest import MONTH_ORDER, PROCESS_ORDER  # noqa: E402
+
+HEADER_PER_ITEM = 4
+CHUNK_ROWS = 1_000_000
+N_CHECKERS = 300
+YEARS = [2023, 2024, 2025]
+GRADE_COLS = ['1年生', '2年生', '3年生', '4年生', '5年生', '6年生', '入学準備', '学年その他']
+# CSVの書き出し元で見かける真偽値の表記（cp932で書けるものだけ）
+TRUE_VALUES = np.array(['TRUE', '1', '○', 'yes'], dtype=object)
+FALSE_VALUES = np.array(['FALSE', '0', '', 'no'], dtype=object)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _flags(rng, n: int, p_true: float) -> np.ndarray:
+    """p_true の割合で真になる表記ゆれ込みのフラグ列"""
+    hit = rng.random(n) < p_true
+    return np.where(hit, TRUE_VALUES[rng.integers(0, len(TRUE_VALUES), n)],
+                    FALSE_VALUES[rng.integers(0, len(FALSE_VALUES), n)])
+
+def _dates(rng, base: np.ndarray, low_days: int, high_days: int) -> np.ndarray:
+    """base から low_days〜high_days 日後の日時（秒単位の乱れ込み）"""
+    offset = rng.integers(low_days * 86400, high_days * 86400, len(base))
+    return base + offset.astype('timedelta64[s]')
+
+def generate_seisakubutsu(n_items: int, rng) -> pd.DataFrame:
+    """制作物一覧（トークンは一意。1つの制作物名に複数工程）"""
+    n_items = max(n_items, 1)
+    n_names = max(n_items // 6, 1)
+    year = np.array(YEARS)[rng.integers(0, len(YEARS), n_items)]
+    start = (year - 1970).astype('datetime64[Y]').astype('datetime64[s]') + np.timedelta64(90, 'D')
+    created = _dates(rng, start, 0, 365)
+    grades = {}
+    for i, col in enumerate(GRADE_COLS):
+        # 低学年ほど対象が多い。学年その他はまれ
+        grades[col] = _flags(rng, n_items, 0.05 if col == '学年その他' else 0.45 - 0.04 * i)
+    return pd.DataFrame({
+        'トークン': pd.Series(np.arange(n_items)).map('S{:09d}'.format),
+        '制作物名': pd.Series(rng.integers(0, n_names, n_items)).map('教材{:07d}'.format),
+        '作成日': pd.Series(created).dt.strftime(DATE_FORMAT),
+        '修正日': pd.Series(_dates(rng, created, 1, 60)).dt.strftime(DATE_FORMAT),
+        '締め切り日': pd.Series(_dates(rng, created, 7, 45)).dt.strftime('%Y-%m-%d'),
+        '年度': year,
+        '発刊月': np.array(MONTH_ORDER, dtype=object)[rng.integers(0, len(MONTH_ORDER), n_items)],
+        '工程': np.array(PROCESS_ORDER, dtype=object)[rng.integers(0, len(PROCESS_ORDER), n_items)],
+        **grades,
+        '備考': '',
+    })
+
+def generate_header_chunks(n_rows: int, seisakubutsu_df: pd.DataFrame, rng, chunk_rows: int = CHUNK_ROWS):
+    """ヘッダー一覧を chunk_rows 行ずつ返す（制作物トークン・担当者・チェック日時・フラグ）"""
+    tokens = seisakubutsu_df['トークン'].to_numpy()
+    created = pd.to_datetime(seisakubutsu_df['作成日']).to_numpy().astype('datetime64[s]')
+    for lo in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - lo)
+        item = rng.integers(0, len(tokens), n)
+        checked = _dates(rng, created[item], 0, 50)
+        yield pd.DataFrame({
+            '制作物トークン': tokens[item],
+            '担当者メールアドレス': pd.Series(rng.integers(0, N_CHECKERS, n)).map('checker{:04d}@example.com'.format),
+            '作成日': pd.Series(created[item]).dt.strftime(DATE_FORMAT),
+            '修正日': pd.Series(checked).dt.strftime(DATE_FORMAT),
+            'チェック済み': _flags(rng, n, 0.7),
+            '次回チェック出し': _flags(rng, n, 0.25),
+            'コメント': '',
+        })
+
+def write_dataset(n_rows: int, out_dir: str, seed: int = 0, encoding: str = 'utf-8-sig'):
+    """
+    ヘッダー n_rows 行の合成データを out_dir に書き出す（既にあれば再生成しない）。
+    戻り値: (制作物一覧CSVのパス, ヘッダー一覧CSVのパス)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stem = f"{n_rows}_{seed}_{encoding}"
+    seisakubutsu_path = os.path.join(out_dir, f"seisakubutsu_{stem}.csv")
+    header_path = os.path.join(out_dir, f"header_{stem}.csv")
+    if os.path.exists(seisakubutsu_path) and os.path.exists(header_path):
+        return seisakubutsu_path, header_path
+    rng = np.random.default_rng(seed)
+    seisakubutsu_df = generate_seisakubutsu(n_rows // HEADER_PER_ITEM, rng)
+    seisakubutsu_df.to_csv(seisakubutsu_path, index=False, encoding=encoding)
+    tmp_path = f"{header_path}.tmp"
+    for i, chunk in enumerate(generate_header_chunks(n_rows, seisakubutsu_df, rng)):
+        # BOMは先頭の1回だけ
+        chunk.to_csv(tmp_path, index=False, header=(i == 0), mode='w' if i == 0 else 'a',
+                     encoding=encoding if i == 0 else encoding.replace('-sig', ''))
+    os.replace(tmp_path, header_path)
+    return seisakubutsu_path, header_path
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    paths = write_dataset(int(args[0]) if args else 10_000, args[1] if len(args) > 1 else 'synth_data',
+                          int(args[2]) if len(args) > 2 else 0, args[3] if len(args) > 3 else 'utf-8-sig')
+    for path in paths:
+        print(f"{path}  ({os.path.getsize(path) / 2**20:.1f} MB)")
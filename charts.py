@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+グラフ（Streamlitに依存しない。画面とバッチレポートで共用）
+- 集計表（analytics の monthly_table / next_check_table）から plotly の図を作る
+- graph_objects で、学年ごと・指標ごとに必要なトレースだけを組み立てる
+"""
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.colors import qualitative
+from plotly.subplots import make_subplots
+
+from ingest import MONTH_ORDER
+
+def _colors(palette, n: int) -> list:
+    """n 個の系列の色（パレットを順に繰り返す）"""
+    return [palette[i % len(palette)] for i in range(n)]
+
+def monthly_figures(monthly: pd.DataFrame, template=None):
+    """
+    発刊月ごとの制作物件数・総工程数の折れ線（学年ごと + 合計）。
+    template は plotly のテンプレート名（None は既定。画面はStreamlitのテーマで上書きされるので 'none' を渡す）
+    """
+    months = [m for m in MONTH_ORDER if m != 'その他']
+    grades = monthly['学年'].drop_duplicates().tolist()
+    colors = _colors(qualitative.T10, len(grades))
+    figures = []
+    for y, title in (('制作物件数', '発刊月ごとの制作物件数'), ('総工程数', '発刊月ごとの総工程数')):
+        fig = go.Figure(layout=go.Layout(template=template))
+        for grade, color in zip(grades, colors):
+            part = monthly[monthly['学年'] == grade]
+            fig.add_trace(go.Scatter(x=part['発刊月'].astype(str).to_numpy(), y=part[y].to_numpy(), name=grade,
+                                     mode='lines+markers', line_color=color))
+        fig.update_layout(title_text=title, legend_title_text='学年', yaxis_title=y)
+        fig.update_xaxes(categoryorder='array', categoryarray=months)
+        figures.append(fig)
+    return figures
+
+def next_check_figure(next_check: pd.DataFrame, template=None):
+    """学年別「次回チェック出し要」の割合・人数の棒グラフ（1つの図に左右に並べる。template は monthly_figures と同じ）"""
+    grades = next_check['学年'].astype(str).to_numpy()
+    colors = _colors(qualitative.Plotly, len(grades))
+    fig = make_subplots(rows=1, cols=2, subplot_titles=('割合(%)', '人数'),
+                        figure=go.Figure(layout=go.Layout(template=template)))
+    fig.add_trace(go.Bar(x=grades, y=next_check['次回チェック出し要_割合(%)'].to_numpy(), marker_color=colors,
+                         texttemplate='%{y:.1f}'), row=1, col=1)
+    fig.add_trace(go.Bar(x=grades, y=next_check['次回チェック出し要_人数'].to_numpy(), marker_color=colors,
+                         texttemplate='%{y}'), row=1, col=2)
+    fig.update_layout(title_text='学年別「次回チェック出し要」の割合・人数', showlegend=False)
+    return fig
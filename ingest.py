@@ -0,0 +1,876 @@
+# -*- coding: utf-8 -*-
+"""
+CSV取り込み層（Streamlitに依存しない）
+- 先頭サンプルから文字コードを判定（UTF-8 BOM / UTF-8 / CP932）
+- ダッシュボードで使う列だけを明示dtypeで読み込む
+- pyarrowがあればpyarrowエンジンで高速パース
+- フラグ列（チェック済み・学年列など）は読み込み時に1回だけbool正規化
+- 日付列は先頭サンプルから書式を判定して一括変換（合わない値だけ個別解釈）
+- 2ファイルはスレッドプールで並行に読み込み、段階ごとの進捗を通知
+- 大きなヘッダーCSVは分割読み込み（チェック者数を逐次集計し、PIIは分割ごとに破棄）
+- 表は作成日で昇順に並べておく（期間フィルターを二分探索で行うため）
+- 結合側はヘッダー側の列と制作物側の行位置（制作物行）だけを持ち、制作物側の列は
+  使う段階で行位置から必要な列だけを引く（join_seisakubutsu。全件結合の列を全行に複製しない）
+- 読み込み後に列を圧縮（未使用列の削除・文字列のカテゴリ化・数値とフラグの縮小）
+- 2ファイルの取り込みから結合・圧縮までを load_tables にまとめ、画面とバッチで共用
+- ヘッダー差分CSV（新規・変更行）の取り込み（行ごとのID列があれば置き換え、無ければ追加のみ。チェック者数は差分で更新）
+- 前処理済みデータのParquetスナップショット（zip束）の書き出し/読み込み
+- 絞り込み結果の書き出し（CSV / gzip CSV / zip / Parquet。CSVは分割して圧縮ストリームへ書く）
+"""
+import codecs
+import csv
+import gzip
+import io
+import json
+import queue
+import secrets
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+class IngestError(ValueError):
+    """取り込み時に見つけた入力の不備（メッセージはそのまま利用者に表示できる）"""
+
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+# ダッシュボードで参照する列（学年列は is_grade_col で別途判定）
+DATE_COLS = ['作成日', '修正日', '締め切り日']
+# ヘッダー行ごとのID列（差分取り込みで既存行と対応させる。最初に見つかった列を使う）
+HEADER_ID_COLS = ['ヘッダートークン', 'ヘッダーID']
+TEXT_COLS = ['トークン', '制作物トークン', '制作物名', '発刊月', '工程', *HEADER_ID_COLS]
+FLAG_COLS = ['チェック済み', '次回チェック出し']
+USED_COLS = TEXT_COLS + DATE_COLS + FLAG_COLS + ['年度', '担当者メールアドレス']
+
+# 発刊月・工程の表示順（工程は実データに存在するものだけをこの順で使う）
+MONTH_ORDER = ['4月号', '5月号', '6月号', '7月号', '8月号', '9月号', '10月号',
+               '11月号', '12月号', '1月号', '2月号', '3月号', 'その他']
+PROCESS_ORDER = list(dict.fromkeys([
+    '仮台割', '入稿前ラフ', '入稿原稿', '組版原稿', '初校', '再校', '再校2', '再校3',
+    '色校', '色校2', '色校3', '念校', '念校2', '念校3', 'α1版',
+    'β1版', 'β2版', 'β3版', 'β4版', 'β5版', 'その他'
+]))
+
+# 文字列でも 'true','1','yes','y','○','✓' などを True とみなすための集合
+TRUE_SET = {'true', '1', 'yes', 'y', 't', 'on', '○', '◯', '✓'}
+
+def to_bool_like(v):
+    """True/False/文字列/数値を幅広くbool解釈する（Noneや空白はFalse）"""
+    if isinstance(v, bool):
+        return v
+    if pd.isna(v):
+        return False
+    s = str(v).strip().lower()
+    return s in TRUE_SET
+
+def normalize_bool_series(s: pd.Series) -> pd.Series:
+    """
+    to_bool_like と同じ解釈をベクトル化して適用し、nullable boolean で返す。
+    ユニーク値だけを判定し（factorize）、コード配列で全行へ展開する。
+    """
+    if pd.api.types.is_bool_dtype(s):
+        return s.astype('boolean').fillna(False)
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    # 末尾に欠損(-1)用のFalseを置き、codes=-1 がそこを指すようにする
+    lut = np.array([to_bool_like(v) for v in uniques] + [False], dtype=bool)
+    return pd.Series(lut[codes], index=s.index, dtype='boolean', name=s.name)
+
+def normalize_flag_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """フラグ列・学年列をその場でboolean化する"""
+    for col in df.columns:
+        if col in FLAG_COLS or is_grade_col(col):
+            df[col] = normalize_bool_series(df[col])
+    return df
+
+def sort_by_date(df: pd.DataFrame, col: str) -> pd.DataFrame:
+    """日付列の昇順（欠損は末尾）に安定ソートし、indexを振り直す。既に並んでいればそのまま"""
+    if col not in df.columns:
+        return df
+    dates = df[col]
+    n_valid = int(dates.notna().sum())
+    if dates.iloc[:n_valid].notna().all() and dates.iloc[:n_valid].is_monotonic_increasing \
+            and isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        return df
+    return df.sort_values(col, kind='stable', na_position='last', ignore_index=True)
+
+def is_grade_col(col: str) -> bool:
+    """学年フラグ列か（〇年生 / 入学準備 / 学年その他）"""
+    return '年生' in col or '学年その他' in col or col == '入学準備'
+
+def detect_encoding(sample: bytes) -> str:
+    """先頭サンプルから文字コードを判定する（BOM付きUTF-8 → UTF-8 → CP932）"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # サンプル末尾で多バイト文字が切れていても失敗扱いにしない
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+def read_header_row(data: bytes, encoding: str) -> list:
+    """CSVの見出し行だけを読む"""
+    text = codecs.getincrementaldecoder(encoding)(errors='replace') \
+        .decode(data[:ENCODING_SAMPLE_BYTES], final=False)
+    return next(csv.reader(io.StringIO(text)), [])
+
+def select_usecols(columns) -> list:
+    """実在する列のうち、ダッシュボードで使う列だけを返す（元の列順を維持）"""
+    return [c for c in columns if c in USED_COLS or is_grade_col(c)]
+
+def read_csv_fast(data: bytes, usecols=None):
+    """
+    CSVバイト列を1回のパースで読み込む。
+    戻り値: (DataFrame, 統計dict{encoding, engine, rows, seconds, rows_per_sec})
+    """
+    t0 = time.perf_counter()
+    encoding = detect_encoding(data[:ENCODING_SAMPLE_BYTES])
+    columns = read_header_row(data, encoding)
+    if usecols is None:
+        usecols = select_usecols(columns)
+    dtype = {c: str for c in TEXT_COLS + DATE_COLS if c in usecols}
+
+    df = None
+    engine = 'pyarrow' if HAS_PYARROW else 'c'
+    if HAS_PYARROW:
+        try:
+            df = pd.read_csv(io.BytesIO(data), encoding=encoding, encoding_errors='replace',
+                             usecols=usecols, dtype=dtype, engine='pyarrow')
+        except Exception:
+            # pyarrowで解釈できない書式（引用符の崩れ等）はCエンジンで再試行
+            engine = 'c'
+    if df is None:
+        df = pd.read_csv(io.BytesIO(data), encoding=encoding, encoding_errors='replace',
+                         usecols=usecols, dtype=dtype, low_memory=False)
+
+    seconds = time.perf_counter() - t0
+    stats = {
+        'encoding': encoding,
+        'engine': engine,
+        'rows': len(df),
+        'seconds': seconds,
+        'rows_per_sec': (len(df) / seconds) if seconds > 0 else 0.0,
+    }
+    return df, stats
+
+# --- 日付解析 ---
+# 書式の候補（先頭サンプルで最も多く解釈できたものを列全体に適用）
+DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+    '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y/%m/%d',
+    '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%d %H:%M:%S%z',
+    '%Y%m%d',
+]
+DATE_SAMPLE_SIZE = 200
+
+def detect_date_format(values: pd.Series):
+    """先頭の非空サンプルを最も多く解釈できる書式（該当なしはNone）"""
+    sample = values.dropna().astype(str).str.strip()
+    sample = sample[sample != ''].head(DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+    best_fmt, best_ok = None, 0
+    for fmt in DATE_FORMATS:
+        ok = int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+        if ok > best_ok:
+            best_fmt, best_ok = fmt, ok
+        if ok == len(sample):
+            break
+    return best_fmt
+
+def _parse_date_value(v):
+    """書式に合わなかった値を個別に解釈（タイムゾーンは外して壁時計時刻のまま）"""
+    try:
+        ts = pd.Timestamp(str(v).strip())
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+    if ts is pd.NaT:
+        return ts
+    return ts.tz_localize(None) if ts.tzinfo is not None else ts
+
+def parse_date_column(values: pd.Series, fmt=None):
+    """
+    日付列をdatetime64（タイムゾーンなし）に変換する。
+    fmt 未指定なら先頭サンプルから判定する。
+    戻り値: (変換後Series, 使用した書式 or None, 個別解釈した件数)
+    """
+    if fmt is None:
+        fmt = detect_date_format(values)
+    if fmt is None:
+        parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    else:
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce')
+        if getattr(parsed.dt, 'tz', None) is not None:
+            parsed = parsed.dt.tz_localize(None)
+    present = values.notna().to_numpy(dtype=bool, copy=True)
+    present[present] = (values[present].astype(str).str.strip() != '').to_numpy(dtype=bool)
+    failed = present & parsed.isna().to_numpy(dtype=bool)
+    n_fallback = int(failed.sum())
+    if n_fallback:
+        # 非準拠の値だけ、ユニーク値単位で個別解釈
+        raw = values[failed]
+        lookup = {u: _parse_date_value(u) for u in raw.unique()}
+        parsed[failed] = pd.to_datetime(raw.map(lookup), errors='coerce').astype(parsed.dtype)
+    return parsed, fmt, n_fallback
+
+# --- 並行読み込み ---
+
+def prepare_csv(data: bytes, on_stage=None):
+    """
+    1ファイル分の取り込み: 読み込み → フラグ正規化 → 日付解析。
+    on_stage(段階名) は各段階の完了時に（ワーカースレッドから）呼ばれる。
+    """
+    on_stage = on_stage or (lambda stage: None)
+    df, stats = read_csv_fast(data)
+    on_stage('CSV解析')
+    t0 = time.perf_counter()
+    normalize_flag_columns(df)
+    formats, n_fallback = {}, 0
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col], formats[col], n = parse_date_column(df[col])
+            n_fallback += n
+    stats['prep_seconds'] = time.perf_counter() - t0
+    stats['date_formats'] = ', '.join(f"{c}={f or '-'}" for c, f in formats.items())
+    stats['date_fallback'] = n_fallback
+    on_stage('日付・フラグ整形')
+    return df, stats
+
+PREPARE_STAGES = 2  # prepare_csv が通知する段階数
+
+def prepare_csv_files(files: dict, on_progress=None) -> dict:
+    """
+    {名前: バイト列} をスレッドプールで並行に prepare_csv する。
+    on_progress(名前, 段階名) は呼び出し元スレッドで呼ばれる（UI更新可）。
+    戻り値: {名前: (DataFrame, 統計dict)}
+    """
+    events = queue.Queue()
+
+    def drain():
+        while True:
+            try:
+                name, stage = events.get_nowait()
+            except queue.Empty:
+                return
+            if on_progress is not None:
+                on_progress(name, stage)
+
+    with ThreadPoolExecutor(max_workers=max(len(files), 1)) as pool:
+        futures = {
+            pool.submit(prepare_csv, data, lambda stage, name=name: events.put((name, stage))): name
+            for name, data in files.items()
+        }
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.1)
+            drain()
+        drain()
+        return {name: future.result() for future, name in futures.items()}
+
+# --- ヘッダー行の識別（差分取り込み用） ---
+# 差分の行を既存行と対応させるのは、ヘッダーCSVに行ごとのID列（HEADER_ID_COLS）があるときだけ。
+# (トークン, 担当者, 作成日) は同じ制作物への繰り返しのチェックで重なるので行の識別には使わず、
+# ID列が無ければ差分は追加のみとして扱う。
+# メールアドレスはセッションごとの鍵付きハッシュにしてから使い、データセットには
+# (トークン, 担当者) の組のハッシュだけを残す。ID列はハッシュ（ヘッダー行キー）にして元の列は落とす。
+ROW_KEY_COL = 'ヘッダー行キー'
+NO_ROW_KEY = np.uint64(0)  # ID が欠損している行（どの行とも対応させない）
+
+def new_hash_key() -> str:
+    """セッションごとのハッシュ鍵（16文字。ハッシュから元のアドレスを辞書引きさせない）"""
+    return secrets.token_hex(8)
+
+def text_hashes(values, hash_key=None) -> np.ndarray:
+    """文字列の（鍵付き）ハッシュ（uint64）。ユニーク値だけをハッシュしてコード配列で展開する"""
+    codes, uniques = pd.factorize(pd.Series(values).astype(str), use_na_sentinel=True)
+    kwargs = {} if hash_key is None else {'hash_key': hash_key}
+    return pd.util.hash_array(np.asarray(uniques, dtype=object), **kwargs)[codes]
+
+def pair_hashes(token_h, mail_h) -> np.ndarray:
+    """(トークン, 担当者) の組のハッシュ（uint64。引数はそれぞれの text_hashes）"""
+    frame = pd.DataFrame({'トークン': np.asarray(token_h, dtype=np.uint64), 'h': np.asarray(mail_h, dtype=np.uint64)})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+def header_id_col(columns):
+    """ヘッダーCSVの行ごとのID列名（無ければ None）"""
+    return next((c for c in HEADER_ID_COLS if c in columns), None)
+
+def row_keys(ids) -> np.ndarray:
+    """ID列からヘッダー行キー（uint64）を作る。欠損は NO_ROW_KEY"""
+    ids = pd.Series(ids)
+    missing = ids.isna().to_numpy()
+    keys = np.full(len(ids), NO_ROW_KEY, dtype=np.uint64)
+    if (~missing).any():
+        keys[~missing] = text_hashes(ids[~missing].astype(str).to_numpy())
+    return keys
+
+def track_header_pairs(header_df: pd.DataFrame, hash_key: str):
+    """
+    (トークン, 担当者) の組のハッシュを求める（メールアドレス列は呼び出し側で落とす）。
+    戻り値: (組のハッシュ[メールアドレスがある行のみ], その行位置)
+    """
+    mail = header_df['担当者メールアドレス']
+    has_mail = np.flatnonzero(mail.notna().to_numpy(dtype=bool))
+    token_h = text_hashes(header_df['トークン'].to_numpy()[has_mail])
+    return pair_hashes(token_h, text_hashes(mail.to_numpy()[has_mail], hash_key)), has_mail
+
+def replace_header_ids(header_df: pd.DataFrame, delta_state=None) -> pd.DataFrame:
+    """
+    ID列を落とす。delta_state を渡すと、落とす前にヘッダー行キー列を付け、
+    使ったID列名を delta_state['row_id'] に書き込む（ID列が無ければ None）。
+    """
+    id_col = header_id_col(header_df.columns)
+    if delta_state is not None:
+        delta_state['row_id'] = id_col
+        if id_col is not None:
+            header_df[ROW_KEY_COL] = row_keys(header_df[id_col])
+    return header_df.drop(columns=[c for c in HEADER_ID_COLS if c in header_df.columns])
+
+# --- ヘッダーCSVの分割読み込み ---
+STREAM_CHUNK_ROWS = 200_000
+STREAM_THRESHOLD_BYTES = 200 * 1024 * 1024  # これを超えるヘッダーCSVは既定で分割読み込み
+
+def stream_header_csv(data: bytes, tokens, chunk_rows: int = STREAM_CHUNK_ROWS, on_chunk=None, delta_state=None):
+    """
+    ヘッダーCSVを chunk_rows 行ずつ読み込む。
+    - 制作物側に存在するトークン（tokens）の行と、使用列だけを残す
+    - チェック者数（トークンごとの担当者メールアドレスのユニーク数）を逐次集計する。
+      メールアドレスはセッションごとの鍵付きハッシュにして分割ごとに列ごと破棄する
+    on_chunk(読込済みバイト割合) は各分割の処理後に呼ばれる。
+    delta_state（dict）を渡すと、ID列があればヘッダー行キー列を付け、(トークン, 担当者) の組のハッシュを
+    delta_state['pairs'] に書き込む（差分取り込み用）。
+    戻り値: (ヘッダーDataFrame[トークン列名は『トークン』], チェック者数DataFrame, 統計dict)
+    """
+    t0 = time.perf_counter()
+    encoding = detect_encoding(data[:ENCODING_SAMPLE_BYTES])
+    usecols = select_usecols(read_header_row(data, encoding))
+    dtype = {c: str for c in TEXT_COLS + DATE_COLS if c in usecols}
+    token_index = pd.Index(pd.unique(pd.Series(tokens).dropna()))
+    track_pairs = delta_state is not None and '担当者メールアドレス' in usecols
+    hash_key = delta_state['hash_key'] if delta_state is not None else new_hash_key()
+
+    buf = io.BytesIO(data)
+    kept, chunk_pairs = [], []
+    date_formats = {}
+    rows_read = n_chunks = n_fallback = 0
+    with pd.read_csv(buf, encoding=encoding, encoding_errors='replace', usecols=usecols,
+                     dtype=dtype, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            n_chunks += 1
+            rows_read += len(chunk)
+            chunk = chunk.rename(columns={'制作物トークン': 'トークン'})
+            if 'トークン' not in chunk.columns:
+                raise IngestError("ヘッダーCSVに『制作物トークン』列がありません。")
+            codes = token_index.get_indexer(chunk['トークン'])
+            in_scope = codes >= 0
+            chunk, codes = chunk[in_scope], codes[in_scope]
+
+            if '担当者メールアドレス' in chunk.columns:
+                mail = chunk['担当者メールアドレス']
+                has_mail = mail.notna().to_numpy(dtype=bool)
+                mail_h = text_hashes(mail, hash_key)
+                # 分割内で重複を除いておき、分割をまたいだ重複は最後に1回だけ除く
+                chunk_pairs.append(pd.DataFrame({'code': codes[has_mail].astype(np.int64),
+                                                 'h': mail_h[has_mail]}).drop_duplicates())
+                chunk = chunk.drop(columns=['担当者メールアドレス'])
+
+            normalize_flag_columns(chunk)
+            for col in DATE_COLS:
+                if col in chunk.columns:
+                    chunk[col], fmt, n = parse_date_column(chunk[col], date_formats.get(col))
+                    if fmt is not None:
+                        date_formats.setdefault(col, fmt)
+                    n_fallback += n
+            kept.append(replace_header_ids(chunk, delta_state))
+            if on_chunk is not None:
+                on_chunk(min(buf.tell() / max(len(data), 1), 1.0))
+
+    header_df = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=['トークン'])
+    pairs = pd.concat([pd.DataFrame({'code': pd.Series(dtype=np.int64), 'h': pd.Series(dtype=np.uint64)}),
+                       *chunk_pairs], ignore_index=True).drop_duplicates()
+    del chunk_pairs
+    counts = pairs.groupby('code').size()
+    if track_pairs:
+        token_h = text_hashes(token_index)
+        delta_state['pairs'] = np.unique(pair_hashes(token_h[pairs['code'].to_numpy()], pairs['h'].to_numpy()))
+    checkers_count_df = pd.DataFrame({'トークン': token_index[counts.index.to_numpy()],
+                                      'チェック者数': counts.to_numpy()})
+    seconds = time.perf_counter() - t0
+    stats = {
+        'encoding': encoding,
+        'engine': f"c(分割{n_chunks})",
+        'rows': rows_read,
+        'seconds': seconds,
+        'rows_per_sec': (rows_read / seconds) if seconds > 0 else 0.0,
+        'kept_rows': len(header_df),
+        'date_formats': ', '.join(f"{c}={f}" for c, f in date_formats.items()),
+        'date_fallback': n_fallback,
+    }
+    return header_df, checkers_count_df, stats
+
+# --- 読み込み後の列圧縮 ---
+# 両方のCSVにある列のうち、どの画面からも参照しない側
+UNUSED_COLS = {
+    'merged': ['作成日_header'],
+    'seisakubutsu': ['修正日', *HEADER_ID_COLS],
+}
+CATEGORY_COLS = ['制作物名', '年度']
+
+def memory_bytes(df: pd.DataFrame) -> int:
+    """文字列の実体まで含めたメモリ使用量（memory_usage(deep=True) の合計）"""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+def _compact_table(df: pd.DataFrame, drop_cols, token_dtype) -> pd.DataFrame:
+    """1テーブル分の列圧縮（未使用列の削除・カテゴリ化・数値/フラグの縮小）"""
+    df = df.drop(columns=[c for c in drop_cols if c in df.columns])
+    for col in df.columns:
+        s = df[col]
+        if col == 'トークン':
+            df[col] = s.astype(token_dtype)
+        elif col in FLAG_COLS or is_grade_col(col):
+            df[col] = normalize_bool_series(s).to_numpy(dtype=bool)
+        elif col == 'チェック者数':
+            df[col] = pd.to_numeric(s, downcast='integer')
+        elif col in CATEGORY_COLS and not isinstance(s.dtype, pd.CategoricalDtype):
+            if pd.api.types.is_integer_dtype(s):
+                df[col] = pd.to_numeric(s, downcast='integer')
+            elif not pd.api.types.is_numeric_dtype(s):
+                df[col] = s.astype('category')
+    return df
+
+def compact_frames(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame):
+    """
+    読み込み済みの2テーブルを省メモリな形に揃える（何度適用しても同じ結果）。
+    トークンはカテゴリにする（両テーブルにあれば共通のカテゴリ。同じトークンは同じ整数コード）。
+    戻り値: (merged_df, seisakubutsu_df, 圧縮前後のメモリ表)
+    """
+    before = [memory_bytes(merged_df), memory_bytes(seisakubutsu_df)]
+    tokens = [df['トークン'].dropna().astype(str) for df in (seisakubutsu_df, merged_df) if 'トークン' in df.columns]
+    categories = pd.unique(pd.concat(tokens, ignore_index=True)) if tokens else []
+    token_dtype = pd.CategoricalDtype(pd.Index(categories, dtype=str))
+    merged_df = _compact_table(merged_df, UNUSED_COLS['merged'], token_dtype)
+    seisakubutsu_df = _compact_table(seisakubutsu_df, UNUSED_COLS['seisakubutsu'], token_dtype)
+    after = [memory_bytes(merged_df), memory_bytes(seisakubutsu_df)]
+    report = pd.DataFrame({
+        'table': ['merged', 'seisakubutsu'],
+        'before_bytes': before,
+        'after_bytes': after,
+    })
+    return merged_df, seisakubutsu_df, report
+
+# --- 2ファイルからのデータセット組み立て ---
+# 2ファイルの取り込み後に続く段階（進捗表示用）
+LOAD_STAGES = ['チェック者数集計', '結合', 'カテゴリ化・並べ替え']
+# 結合側（ヘッダー行）が参照する制作物側の行位置の列
+SEI_ROW_COL = '制作物行'
+# 両方のCSVにある列（結合側ではヘッダー側に『_header』、制作物側に『_seisakubutsu』を付けて区別する）
+SUFFIXED_COLS = ['作成日', '修正日']
+
+def count_checkers(header_df: pd.DataFrame, delta_state=None):
+    """
+    トークンごとのチェック者数（担当者メールアドレスのユニーク数）を集計し、PII列を落とす。
+    ID列は落とす。delta_state（dict）を渡すと、ID列があればヘッダー行キー列を付け、
+    PII列を落とす前に (トークン, 担当者) の組のハッシュを delta_state['pairs'] に書き込む（差分取り込み用）。
+    戻り値: (PII除去後のheader_df, チェック者数DataFrame[トークン, チェック者数])
+    """
+    header_df = replace_header_ids(header_df, delta_state)
+    if '担当者メールアドレス' not in header_df.columns:
+        return header_df, pd.DataFrame(columns=['トークン', 'チェック者数'])
+    if delta_state is not None:
+        delta_state['pairs'] = np.unique(track_header_pairs(header_df, delta_state['hash_key'])[0])
+    checkers_count_df = header_df.groupby('トークン')['担当者メールアドレス'].nunique().reset_index()
+    checkers_count_df.rename(columns={'担当者メールアドレス': 'チェック者数'}, inplace=True)
+    return header_df.drop(columns=['担当者メールアドレス']), checkers_count_df
+
+def link_header_rows(header_df: pd.DataFrame, sei_tokens: pd.Series) -> pd.DataFrame:
+    """
+    ヘッダー行にトークンが一致する制作物側の行位置（制作物行）を付け、トークン列を落とす。
+    制作物側に無いトークンの行は落とし、一致する制作物行が複数あれば行を複製する（全件結合と同じ行の組）。
+    制作物行の順（制作物側が作成日順なら作成日順）に安定ソートして返す。
+    """
+    rows = pd.DataFrame({'トークン': sei_tokens.to_numpy(),
+                         SEI_ROW_COL: np.arange(len(sei_tokens), dtype=np.int32 if len(sei_tokens) < 2**31 else np.int64)})
+    linked = pd.merge(header_df, rows, on='トークン').drop(columns=['トークン'])
+    return linked.sort_values(SEI_ROW_COL, kind='stable', ignore_index=True)
+
+def join_seisakubutsu(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, cols=None) -> pd.DataFrame:
+    """
+    結合側の行に、制作物行から引いた制作物側の列を付ける（cols 未指定なら全列。無い列は無視）。
+    seisakubutsu_df は制作物行が指す表（絞り込み前の全体）を渡す。
+    列名は全件結合と同じ（SUFFIXED_COLS には『_seisakubutsu』を付ける）で、トークンを先頭に置く。
+    """
+    cols = [c for c in (seisakubutsu_df.columns if cols is None else cols) if c in seisakubutsu_df.columns]
+    gathered = seisakubutsu_df[cols].take(merged_df[SEI_ROW_COL].to_numpy()).set_axis(merged_df.index)
+    gathered.columns = [f"{c}_seisakubutsu" if c in SUFFIXED_COLS else c for c in cols]
+    joined = pd.concat([merged_df, gathered], axis=1)
+    if 'トークン' in joined.columns:
+        joined = joined[['トークン'] + [c for c in joined.columns if c != 'トークン']]
+    return joined
+
+def assemble_dataset(seisakubutsu_df: pd.DataFrame, header_df: pd.DataFrame, checkers_count_df: pd.DataFrame,
+                     on_stage=None):
+    """
+    チェック者数の付与 → 発刊月・工程のカテゴリ化 → 作成日順の並べ替え → ヘッダー行と制作物行の対応付け。
+    結合側はヘッダー側の列（SUFFIXED_COLS は『_header』付き）と制作物行だけを持つ。
+    制作物側と同名のその他の列は制作物側を正として落とす。
+    on_stage(段階名) は 結合 と カテゴリ化・並べ替え の完了時に呼ばれる。
+    戻り値: (merged_df, seisakubutsu_df)。トークン列が無ければ IngestError
+    """
+    on_stage = on_stage or (lambda stage: None)
+    if 'トークン' not in header_df.columns or 'トークン' not in seisakubutsu_df.columns:
+        raise IngestError("双方のCSVに『トークン』列が必要です。")
+    seisakubutsu_df = pd.merge(seisakubutsu_df, checkers_count_df, on='トークン', how='left')
+    seisakubutsu_df['チェック者数'] = seisakubutsu_df['チェック者数'].fillna(0)
+    header_df = header_df.rename(columns={c: f"{c}_header" for c in SUFFIXED_COLS if c in seisakubutsu_df.columns})
+    header_df = header_df.drop(columns=[c for c in header_df.columns
+                                        if c != 'トークン' and c in seisakubutsu_df.columns])
+    on_stage(LOAD_STAGES[1])
+
+    if '発刊月' in seisakubutsu_df.columns:
+        seisakubutsu_df['発刊月'] = pd.Categorical(seisakubutsu_df['発刊月'], categories=MONTH_ORDER, ordered=True)
+    # 実データに存在する工程のみ許容
+    if '工程' in seisakubutsu_df.columns:
+        existing_processes = seisakubutsu_df['工程'].dropna().unique()
+        process_order = [p for p in PROCESS_ORDER if p in existing_processes]
+        seisakubutsu_df['工程'] = pd.Categorical(seisakubutsu_df['工程'], categories=process_order, ordered=True)
+
+    # 制作物側を作成日順に並べてから行位置を付ける（結合側も制作物行の順＝作成日順になり、
+    # 期間フィルターはどちらも二分探索で切り出せる）
+    seisakubutsu_df = sort_by_date(seisakubutsu_df, '作成日')
+    merged_df = link_header_rows(header_df, seisakubutsu_df['トークン'])
+    on_stage(LOAD_STAGES[2])
+    return merged_df, seisakubutsu_df
+
+def load_tables(seisakubutsu_data: bytes, header_data: bytes, stream_header: bool = False, on_progress=None,
+                delta_state=None):
+    """
+    2つのCSVバイト列から前処理・列圧縮済みの2テーブルを作る（画面・バッチ共通の読み込み手順）。
+    on_progress(進捗0〜1, 表示文) は呼び出し元スレッドで呼ばれる。
+    delta_state（空のdict）を渡すと、後から apply_header_delta で差分を取り込むための状態を書き込み、
+    結合側にヘッダー行キー列を残す。
+    結合側はヘッダー側の列と制作物行だけを持つ（制作物側の列は join_seisakubutsu で引く）。
+    戻り値: (merged_df, seisakubutsu_df, 取り込み統計DataFrame, 圧縮前後のメモリ表)。入力不備は IngestError
+    """
+    on_progress = on_progress or (lambda frac, text: None)
+    if delta_state is not None:
+        delta_state['hash_key'] = new_hash_key()
+    total_stages = 2 * PREPARE_STAGES + len(LOAD_STAGES)
+    done_stages = 0
+
+    def advance(label):
+        nonlocal done_stages
+        done_stages += 1
+        on_progress(min(done_stages / total_stages, 1.0), f"{label}（{done_stages}/{total_stages}）")
+
+    if stream_header:
+        # 制作物側を先に読み、ヘッダーは分割読み込みで必要な行・列だけ残す（PIIは分割ごとに破棄）
+        seisakubutsu_df, seisakubutsu_stats = prepare_csv(
+            seisakubutsu_data, on_stage=lambda stage: advance(f"制作物一覧: {stage}完了")
+        )
+        if 'トークン' not in seisakubutsu_df.columns:
+            raise IngestError("双方のCSVに『トークン』列が必要です。")
+        base = done_stages
+        header_df, checkers_count_df, header_stats = stream_header_csv(
+            header_data, seisakubutsu_df['トークン'],
+            on_chunk=lambda frac: on_progress(min((base + frac * PREPARE_STAGES) / total_stages, 1.0),
+                                              f"ヘッダー一覧: 分割読み込み中 {frac:.0%}"),
+            delta_state=delta_state
+        )
+        done_stages = base + PREPARE_STAGES - 1
+        advance("ヘッダー一覧: 分割読み込み完了")
+    else:
+        # 2ファイルを並行に取り込み（文字コード判定・使用列のみの読み込み・フラグ/日付整形）
+        prepared = prepare_csv_files(
+            {'制作物一覧': seisakubutsu_data, 'ヘッダー一覧': header_data},
+            on_progress=lambda name, stage: advance(f"{name}: {stage}完了")
+        )
+        seisakubutsu_df, seisakubutsu_stats = prepared['制作物一覧']
+        header_df, header_stats = prepared['ヘッダー一覧']
+        header_df.rename(columns={'制作物トークン': 'トークン'}, inplace=True)
+        # 集計後はPIIを即削除（キャッシュにも載せない）
+        header_df, checkers_count_df = count_checkers(header_df, delta_state)
+    ingest_stats = pd.DataFrame([
+        {'ファイル': '制作物一覧', **seisakubutsu_stats},
+        {'ファイル': 'ヘッダー一覧', **header_stats},
+    ])
+    advance(LOAD_STAGES[0])
+
+    merged_df, seisakubutsu_df = assemble_dataset(seisakubutsu_df, header_df, checkers_count_df, on_stage=advance)
+    # 未使用列の削除・カテゴリ化・数値の縮小
+    merged_df, seisakubutsu_df, memory_report = compact_frames(merged_df, seisakubutsu_df)
+    return merged_df, seisakubutsu_df, ingest_stats, memory_report
+
+# --- ヘッダー差分の取り込み ---
+
+def _align_appended(merged_df: pd.DataFrame, appended: pd.DataFrame):
+    """追加行の列・型を結合側に揃える（カテゴリ列は足りないカテゴリを結合側へ追加）"""
+    appended = appended.reindex(columns=merged_df.columns)
+    for col in merged_df.columns:
+        dtype = merged_df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            extra = pd.Index(appended[col].dropna().astype(object).unique()).difference(dtype.categories)
+            if len(extra):
+                merged_df[col] = merged_df[col].cat.add_categories(extra)
+                dtype = merged_df[col].dtype
+            appended[col] = appended[col].astype(object).astype(dtype)
+        elif pd.api.types.is_bool_dtype(dtype):
+            appended[col] = normalize_bool_series(appended[col]).to_numpy(dtype=bool)
+        else:
+            appended[col] = appended[col].astype(dtype)
+    return merged_df, appended
+
+def _insertion_order(rows: np.ndarray, new_rows: np.ndarray) -> np.ndarray:
+    """
+    制作物行の順に並んだ n 行の後ろに新しい行を足した表を、同じ順に並べ直す位置。
+    link_header_rows の安定ソートと同じ結果を、既存行の並びを保ったまま挿入位置だけで求める。
+    """
+    n_old = len(rows)
+    new_order = np.argsort(new_rows, kind='stable')
+    pos = np.searchsorted(rows, new_rows[new_order], side='right')
+    return np.insert(np.arange(n_old), pos, n_old + new_order)
+
+def apply_header_delta(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, delta_data: bytes, delta_state: dict):
+    """
+    ヘッダー差分CSV（新規・変更されたヘッダー行）を読み込み済みの2テーブルへ反映する。
+    - 読み込み時と差分の両方にID列があれば、IDが既存行と同じ行はその行のヘッダー側の列を置き換える
+      （行の位置はそのまま）。差分内に同じIDが複数あれば最後の行を使う
+    - ID列が無ければ差分は追加のみ。それ以外の行も制作物行を付けて追加し、制作物行の順の位置へ挿入する（制作物側の行は変わらない）
+    - チェック者数は新しく現れた (トークン, 担当者) の組の数だけ増やす（delta_state['pairs'] も更新）
+    戻り値: (merged_df, seisakubutsu_df, 差分dict)。差分dict は集計の差分更新に使う:
+      removed / replaced: 置き換え前後の行、appended: 追加行、tokens: 結合側の状態が変わったトークン
+      [トークン, before, after, was_present]、stats: 取り込み統計
+    差分を取り込めないデータセット・列の不足は IngestError
+    """
+    if SEI_ROW_COL not in merged_df.columns or 'pairs' not in delta_state \
+            or not isinstance(seisakubutsu_df['トークン'].dtype, pd.CategoricalDtype):
+        raise IngestError("このデータには差分を取り込めません（CSVから読み込み直してください）。")
+    header_df, stats = prepare_csv(delta_data)
+    header_df = header_df.rename(columns={'制作物トークン': 'トークン'})
+    missing = [c for c in ('トークン', '担当者メールアドレス') if c not in header_df.columns]
+    if missing:
+        names = ['制作物トークン' if c == 'トークン' else c for c in missing]
+        raise IngestError(f"差分CSVに『{'』『'.join(names)}』列がありません。")
+
+    # 制作物側に存在するトークンの行だけを対象にする（全件読み込み時の結合と同じ）
+    token_dtype = seisakubutsu_df['トークン'].dtype
+    n_tokens = len(token_dtype.categories)
+    codes = pd.Categorical(header_df['トークン'], dtype=token_dtype).codes.astype(np.int64)
+    header_df, codes = header_df[codes >= 0].reset_index(drop=True), codes[codes >= 0]
+
+    # ヘッダー行キー（読み込み時と同じID列があるときだけ既存行と対応させる）
+    id_col = delta_state.get('row_id')
+    match_rows = ROW_KEY_COL in merged_df.columns and id_col is not None and id_col in header_df.columns
+    if match_rows:
+        keys = row_keys(header_df[id_col])
+        superseded = pd.Series(keys).duplicated(keep='last').to_numpy() & (keys != NO_ROW_KEY)
+        header_df, codes = header_df[~superseded].reset_index(drop=True), codes[~superseded]
+        header_df[ROW_KEY_COL] = keys[~superseded]
+    elif ROW_KEY_COL in merged_df.columns:
+        header_df[ROW_KEY_COL] = NO_ROW_KEY
+    header_df = header_df.drop(columns=[c for c in HEADER_ID_COLS if c in header_df.columns])
+
+    pairs, has_mail = track_header_pairs(header_df, delta_state['hash_key'])
+    pairs, first = np.unique(pairs, return_index=True)
+    pair_codes = codes[has_mail][first]
+    header_df = header_df.drop(columns=['担当者メールアドレス'])
+
+    # チェック者数: 既知の組（ソート済み）に無い組だけを数える
+    known_pairs = delta_state['pairs']
+    at = np.searchsorted(known_pairs, pairs)
+    fresh = (at >= len(known_pairs)) | (known_pairs[np.minimum(at, len(known_pairs) - 1)] != pairs) \
+        if len(known_pairs) else np.ones(len(pairs), dtype=bool)
+    delta_state['pairs'] = np.insert(known_pairs, at[fresh], pairs[fresh])
+    increment = np.bincount(pair_codes[fresh], minlength=n_tokens)
+
+    s_codes = seisakubutsu_df['トークン'].cat.codes.to_numpy().astype(np.int64)
+    s_inc = np.where(s_codes >= 0, increment[s_codes], 0)
+    before = np.zeros(n_tokens, dtype=np.int64)
+    if 'チェック者数' in seisakubutsu_df.columns:
+        s_counts = seisakubutsu_df['チェック者数'].to_numpy(dtype=np.int64)
+        before[s_codes[s_codes >= 0]] = s_counts[s_codes >= 0]
+        seisakubutsu_df = seisakubutsu_df.assign(チェック者数=pd.to_numeric(s_counts + s_inc, downcast='integer'))
+
+    # ヘッダー側の列（全件読み込み時と同じ列名に揃える）
+    rename = {}
+    for col in header_df.columns:
+        if col in ('トークン', ROW_KEY_COL):
+            continue
+        if f"{col}_header" in merged_df.columns:
+            rename[col] = f"{col}_header"
+        elif col in merged_df.columns:
+            rename[col] = col
+    key_cols = [ROW_KEY_COL] if ROW_KEY_COL in merged_df.columns else []
+    header_df = _compact_table(header_df[['トークン', *key_cols, *rename]].rename(columns=rename), [], token_dtype)
+    header_cols = [*key_cols, *rename.values()]
+
+    # 既存行との突き合わせ（ヘッダー行キー。IDの無い行はどの行とも対応させない）
+    hit = src = np.array([], dtype=np.int64)
+    if match_rows:
+        delta_keys = header_df[ROW_KEY_COL].to_numpy()
+        merged_keys = merged_df[ROW_KEY_COL].to_numpy()
+        keyed = np.flatnonzero(delta_keys != NO_ROW_KEY)
+        hit = np.flatnonzero(pd.Series(merged_keys).isin(delta_keys[keyed]).to_numpy())
+        src = keyed[pd.Index(delta_keys[keyed]).get_indexer(merged_keys[hit])]
+    matched = np.zeros(len(header_df), dtype=bool)
+    matched[src] = True
+
+    appended = link_header_rows(header_df[~matched], seisakubutsu_df['トークン'])
+    m_rows = merged_df[SEI_ROW_COL].to_numpy()
+    m_codes = s_codes[m_rows]
+    was_present = np.zeros(n_tokens, dtype=bool)
+    was_present[m_codes[m_codes >= 0]] = True
+
+    removed = merged_df.iloc[hit]
+    merged_df, appended = _align_appended(merged_df.copy(deep=False), appended)
+    combined = pd.concat([merged_df, appended], ignore_index=True)
+    for col in header_cols:
+        j = combined.columns.get_loc(col)
+        combined.iloc[hit, j] = header_df[col].to_numpy()[src]
+
+    n_old = len(merged_df)
+    replaced = combined.iloc[hit]
+    appended = combined.iloc[n_old:]
+    a_rows = appended[SEI_ROW_COL].to_numpy()
+    result = combined.take(_insertion_order(m_rows, a_rows)).reset_index(drop=True) if len(appended) else combined
+
+    a_codes = s_codes[a_rows]
+    now_present = was_present.copy()
+    now_present[a_codes[a_codes >= 0]] = True
+    changed = np.flatnonzero((increment > 0) | (now_present & ~was_present))
+    tokens = pd.DataFrame({
+        'トークン': pd.Categorical.from_codes(changed, dtype=token_dtype),
+        'before': before[changed],
+        'after': before[changed] + increment[changed],
+        'was_present': was_present[changed],
+    })
+    stats.update({'kept_rows': len(header_df), 'replaced_rows': len(hit), 'appended_rows': len(appended),
+                  'row_id': id_col if match_rows else None})
+    delta = {'removed': removed, 'replaced': replaced, 'appended': appended, 'tokens': tokens, 'stats': stats}
+    return result, seisakubutsu_df, delta
+
+# --- 前処理済みスナップショット ---
+# zip内に manifest.json と各テーブルのParquet（zstd圧縮）を格納する
+SNAPSHOT_SCHEMA_VERSION = 3  # 2: フラグ列をboolean化 / 3: 結合側はヘッダー側の列と制作物行のみ
+SNAPSHOT_TABLES = ('merged', 'seisakubutsu')
+SNAPSHOT_MANIFEST = 'manifest.json'
+
+def _parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """型が混在したobject列は文字列化してParquetに書ける形にする"""
+    obj_cols = df.select_dtypes(include=['object']).columns
+    if len(obj_cols) == 0:
+        return df
+    df = df.copy()
+    for col in obj_cols:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+def write_snapshot(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame) -> bytes:
+    """前処理済み（PII除去済み）の2テーブルをスナップショットのバイト列にする"""
+    if not HAS_PYARROW:
+        raise RuntimeError("スナップショットの書き出しには pyarrow が必要です。")
+    # ヘッダー行キーはセッションごとの鍵によるもので、別のセッションでは使えない
+    merged_df = merged_df.drop(columns=[ROW_KEY_COL], errors='ignore')
+    frames = dict(zip(SNAPSHOT_TABLES, (merged_df, seisakubutsu_df)))
+    manifest = {
+        'schema_version': SNAPSHOT_SCHEMA_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'tables': {name: {'rows': len(df), 'columns': [str(c) for c in df.columns]}
+                   for name, df in frames.items()},
+    }
+    buf = io.BytesIO()
+    # Parquet自体が圧縮済みなのでzipは無圧縮で格納
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr(SNAPSHOT_MANIFEST, json.dumps(manifest, ensure_ascii=False))
+        for name, df in frames.items():
+            part = io.BytesIO()
+            _parquet_safe(df).to_parquet(part, engine='pyarrow', compression='zstd', index=False)
+            zf.writestr(f"{name}.parquet", part.getvalue())
+    return buf.getvalue()
+
+def read_snapshot(data: bytes):
+    """
+    スナップショットを読み込む。
+    戻り値: (merged_df, seisakubutsu_df, 統計dict)
+    形式不正・スキーマ不一致は IngestError
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError("スナップショットの読み込みには pyarrow が必要です。")
+    t0 = time.perf_counter()
+    # 壊れたzip・メンバーの欠落・壊れたParquetはいずれも形式不正として扱う
+    invalid = (zipfile.BadZipFile, KeyError, ValueError, OSError, pyarrow.ArrowException)
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+        manifest = json.loads(zf.read(SNAPSHOT_MANIFEST).decode('utf-8'))
+    except invalid:
+        raise IngestError("スナップショットの形式が不正です。")
+    with zf:
+        if not isinstance(manifest, dict) or manifest.get('schema_version') != SNAPSHOT_SCHEMA_VERSION:
+            raise IngestError("スナップショットのスキーマバージョンが一致しません。")
+        try:
+            frames = [pd.read_parquet(io.BytesIO(zf.read(f"{name}.parquet")), engine='pyarrow')
+                      for name in SNAPSHOT_TABLES]
+        except invalid:
+            raise IngestError("スナップショットの形式が不正です。")
+    seconds = time.perf_counter() - t0
+    rows = sum(len(df) for df in frames)
+    stats = {
+        'encoding': '-',
+        'engine': 'parquet',
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_sec': (rows / seconds) if seconds > 0 else 0.0,
+    }
+    return frames[0], frames[1], stats
+
+# --- 絞り込み結果の書き出し ---
+# 形式: (表示名, ファイル名, MIME)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'filtered_data.csv', 'text/csv'),
+    'csv.gz': ('CSV（gzip圧縮）', 'filtered_data.csv.gz', 'application/gzip'),
+    'zip': ('ZIP（CSV）', 'filtered_data.zip', 'application/zip'),
+    'parquet': ('Parquet', 'filtered_data.parquet', 'application/vnd.apache.parquet'),
+}
+EXPORT_CHUNK_ROWS = 100_000
+
+def _write_csv_chunks(df: pd.DataFrame, raw, chunk_rows: int):
+    """バイナリストリームへ chunk_rows 行ずつCSVを書く（UTF-8-SIG: Excel互換、BOMは先頭のみ）"""
+    text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    for lo in range(0, max(len(df), 1), chunk_rows):
+        df.iloc[lo:lo + chunk_rows].to_csv(text, index=False, header=(lo == 0))
+    text.flush()
+    text.detach()
+
+def export_frame(df: pd.DataFrame, fmt: str = 'csv', columns=None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> bytes:
+    """
+    絞り込み結果をダウンロード用のバイト列にする（columns 指定時はその列だけ、元の列順で）。
+    CSV系は行を分割して（圧縮）ストリームへ直接書き、CSV全体の文字列を作らない。
+    """
+    if columns is not None:
+        df = df[[c for c in df.columns if c in set(columns)]]
+    buf = io.BytesIO()
+    if fmt == 'csv':
+        _write_csv_chunks(df, buf, chunk_rows)
+    elif fmt == 'csv.gz':
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as gz:
+            _write_csv_chunks(df, gz, chunk_rows)
+    elif fmt == 'zip':
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open(EXPORT_FORMATS['csv'][1], 'w', force_zip64=True) as member:
+                _write_csv_chunks(df, member, chunk_rows)
+    elif fmt == 'parquet':
+        if not HAS_PYARROW:
+            raise RuntimeError("Parquetでの書き出しには pyarrow が必要です。")
+        _parquet_safe(df).to_parquet(buf, engine='pyarrow', compression='zstd', index=False,
+                                     row_group_size=chunk_rows)
+    else:
+        raise ValueError(f"未対応の形式です: {fmt}")
+    return buf.getvalue()
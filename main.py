@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import io
 import gc
-from datetime import datetime
-import re
+import hashlib
+import secrets
+import time
+from functools import partial
+
+from analytics import (ROW_ATTR_COLS, build_cube_entry, build_grade_bits, build_name_codes, cube_entry_apply_delta,
+                       cube_slice, cube_source, date_slice, grade_mask_of, grade_pairs, grades_in_mask, linked_slice,
+                       match_names, monthly_table, next_check_table, performance_table, row_source, rows_matching,
+                       summary_table, union_mask)
+from charts import monthly_figures, next_check_figure
+from ingest import (EXPORT_FORMATS, HAS_PYARROW, MONTH_ORDER, PROCESS_ORDER, ROW_KEY_COL, SEI_ROW_COL,
+                    STREAM_THRESHOLD_BYTES, IngestError, apply_header_delta, compact_frames, export_frame,
+                    is_grade_col, join_seisakubutsu, load_tables, read_snapshot, write_snapshot)
+from profiling import PROFILE_ENV, finish_trace, mark, profile_enabled_by_env, start_trace, trace_frame, trace_json
+from store import (STORE_ENABLE_ENV, acquire_dataset, publish_dataset, release_dataset, shared_derived,
+                   shared_store_enabled_by_env, store_status)
 
 # =========================
 # セキュリティ/堅牢化ポイント
-# - キャッシュ未使用（@st.cache_data削除）
+# - @st.cache_data不使用（ディスク/プロセス共有キャッシュなし）
+#   → セッション内のみ・アップロード内容のハッシュをキーに、PII除去済みデータだけ保持
+#   （例外: 任意の共有データ。PII除去済みの前処理済みデータだけを、アップロード内容のハッシュをキーに
+#    サーバー上へ置く。同じファイルをアップロードしたセッションだけが開ける）
 # - PII(担当者メールアドレス)は集計後に即drop
 # - 例外は簡素化して詳細は出さない
 # - ダウンロードはUTF-8-SIG（Excel互換）
@@ -17,464 +33,690 @@ import re
 # - 欠損列は安全にスキップ or 0扱い
 # =========================
 
-month_order = ['4月号', '5月号', '6月号', '7月号', '8月号', '9月号', '10月号',
-               '11月号', '12月号', '1月号', '2月号', '3月号', 'その他']
-
-original_process_order = list(dict.fromkeys([
-    '仮台割', '入稿前ラフ', '入稿原稿', '組版原稿', '初校', '再校', '再校2', '再校3',
-    '色校', '色校2', '色校3', '念校', '念校2', '念校3', 'α1版',
-    'β1版', 'β2版', 'β3版', 'β4版', 'β5版', 'その他'
-]))
-
 # --- Streamlit ページ設定 ---
 st.set_page_config(page_title="社内チェック業務 BPR分析ツール", layout="wide")
 st.title("📊 社内チェック業務 BPR分析ツール")
 
 # --- ユーティリティ ---
 
-# 文字列でも 'true','1','yes','y','○','✓' などを True とみなすための集合
-TRUE_SET = {'true', '1', 'yes', 'y', 't', 'on', '○', '◯', '✓'}
-
-def to_bool_like(v):
-    """True/False/文字列/数値を幅広くbool解釈する（Noneや空白はFalse）"""
-    if isinstance(v, bool):
-        return v
-    if pd.isna(v):
-        return False
-    s = str(v).strip().lower()
-    return s in TRUE_SET
-
-def num_fillna_inplace(df: pd.DataFrame, val=0):
-    """DataFrameの数値列だけNAを埋める"""
-    if df is None or df.empty:
+def as_mask(cond: pd.Series):
+    """条件Seriesを書き込み可能なbool配列にする（欠損はFalse）"""
+    return cond.to_numpy(dtype=bool, na_value=False, copy=True)
+
+def export_joined(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, fmt: str, columns) -> bytes:
+    """結合側の行に制作物側の列を付けて書き出す（ダウンロードのクリック時のみ実行）"""
+    return export_frame(join_seisakubutsu(merged_df, seisakubutsu_df), fmt, columns)
+
+# --- セッション内キャッシュ ---
+# st.session_state のみに保持（ディスク・他セッションとは共有しない）
+PII_COLS = ['担当者メールアドレス']
+CACHE_STATE_KEY = '_dataset_cache'
+CACHE_UPLOAD_KEY = '_dataset_cache_upload'
+CACHE_DIGESTS_KEY = '_upload_digests'
+CACHE_TTL_SEC = 30 * 60                 # 最終アクセスからの有効期限
+CACHE_MAX_ENTRIES = 8
+CACHE_MAX_BYTES = 512 * 1024 * 1024     # 保持データの合計上限（deep memory換算）
+# データセットから導いたエントリ（データセットを保持しなくなったら一緒に破棄する）
+CACHE_DERIVED_KEYS = {'dataset': ('delta_state', 'cube', 'grade_bits', 'name_index')}
+
+def strip_pii(df: pd.DataFrame) -> pd.DataFrame:
+    """PII列を除いたDataFrameを返す（列が無ければそのまま）"""
+    if df is None:
+        return df
+    drop_cols = [c for c in df.columns if c in PII_COLS or any(c.startswith(f"{p}_") for p in PII_COLS)]
+    return df.drop(columns=drop_cols) if drop_cols else df
+
+def upload_digest(*files) -> str:
+    """アップロード内容のSHA-256（file_id単位でメモ化し、再実行ごとの再ハッシュを避ける）"""
+    memo = st.session_state.setdefault(CACHE_DIGESTS_KEY, {})
+    h = hashlib.sha256()
+    for f in files:
+        fid = getattr(f, 'file_id', None)
+        digest = memo.get(fid) if fid is not None else None
+        if digest is None:
+            digest = hashlib.sha256(f.getvalue()).hexdigest()
+            if fid is not None:
+                memo[fid] = digest
+        h.update(digest.encode('ascii'))
+    return h.hexdigest()
+
+def _cache_nbytes(value) -> int:
+    """キャッシュ値のおおよそのメモリ量（DataFrame/Seriesはdeep計測）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_cache_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_cache_nbytes(v) for v in value.values())
+    return 0
+
+def session_cache_reset(upload_key: str):
+    """アップロードが変わったらキャッシュを全破棄する"""
+    if st.session_state.get(CACHE_UPLOAD_KEY) != upload_key:
+        st.session_state[CACHE_STATE_KEY] = {}
+        st.session_state[CACHE_UPLOAD_KEY] = upload_key
+        gc.collect()
+
+def _session_cache_evict(cache: dict, now: float):
+    """TTL切れを削除し、件数・容量上限を超える分は最終アクセスが古い順に削除（データセットを削除したら、そこから導いたエントリも削除）"""
+    evicted = [k for k, e in cache.items() if now - e['last_access'] > CACHE_TTL_SEC]
+    for k in evicted:
+        del cache[k]
+    total = sum(e['nbytes'] for e in cache.values())
+    for k in sorted(cache, key=lambda k: cache[k]['last_access']):
+        if len(cache) <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+            break
+        total -= cache[k]['nbytes']
+        del cache[k]
+        evicted.append(k)
+    for k in evicted:
+        for derived in CACHE_DERIVED_KEYS.get(k, ()):
+            cache.pop(derived, None)
+
+def session_cache_get(key):
+    """キャッシュ取得（無い/期限切れはNone）"""
+    cache = st.session_state.setdefault(CACHE_STATE_KEY, {})
+    now = time.monotonic()
+    _session_cache_evict(cache, now)
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    entry['last_access'] = now
+    return entry['value']
+
+def session_cache_put(key, value):
+    """キャッシュ登録（上限を超える単一値は保持せず、古い値とそこから導いたエントリも破棄する）"""
+    cache = st.session_state.setdefault(CACHE_STATE_KEY, {})
+    nbytes = _cache_nbytes(value)
+    if nbytes > CACHE_MAX_BYTES:
+        session_cache_drop(key)
         return
-    num_cols = df.select_dtypes(include=['number']).columns
-    if len(num_cols) > 0:
-        df[num_cols] = df[num_cols].fillna(val)
-
-def safe_bool_series(df: pd.DataFrame, col: str) -> pd.Series:
-    """
-    df[col] を安全にブール評価したSeriesを返す。
-    - 列が無い場合は全False
-    - 値が 'True' / '1' / 'yes' / '○' / '✓' などでも True と解釈
-    """
-    if df is None or df.empty or col not in df.columns:
-        return pd.Series(False, index=(df.index if isinstance(df, pd.DataFrame) else None), dtype=bool)
-    return df[col].map(to_bool_like)
-
-def has_cols(df: pd.DataFrame, cols) -> bool:
-    """必要列がすべて存在するか"""
-    return df is not None and set(cols).issubset(set(df.columns))
+    now = time.monotonic()
+    cache[key] = {'value': value, 'nbytes': nbytes, 'last_access': now}
+    _session_cache_evict(cache, now)
+
+def session_cache_drop(key):
+    """キャッシュから1件（と、そこから導いたエントリ）を削除する（次回の取得で作り直させる）"""
+    cache = st.session_state.setdefault(CACHE_STATE_KEY, {})
+    for k in (key, *CACHE_DERIVED_KEYS.get(key, ())):
+        cache.pop(k, None)
+
+# --- グラフのキャッシュ ---
+# 集計表の内容のハッシュをキーに、作ったグラフをセッション内で使い回す（集計結果が変わらない再実行では作り直さない）。
+# テンプレートは画面側（Streamlitのテーマ）で上書きされるので送らない。
+# JSON化と送信は st.plotly_chart が呼び出しごとに行うので省けない（1枚あたり約1KB。描画は選択中の工程の分だけ）
+FIGURE_CACHE_KEY = '_figure_cache'
+FIGURE_CACHE_MAX = 32
+FIGURE_TEMPLATE = 'none'
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """表の内容（列名・値）のハッシュ"""
+    h = hashlib.sha256(repr([str(c) for c in df.columns]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def cached_figure(build, table: pd.DataFrame):
+    """build(table, template) の結果を集計表の内容でキャッシュする（最近使った FIGURE_CACHE_MAX 件）"""
+    cache = st.session_state.setdefault(FIGURE_CACHE_KEY, {})
+    key = (build.__name__, frame_digest(table))
+    figure = cache.pop(key, None)
+    if figure is None:
+        figure = build(table, FIGURE_TEMPLATE)
+    cache[key] = figure  # 末尾＝最近使ったもの
+    while len(cache) > FIGURE_CACHE_MAX:
+        cache.pop(next(iter(cache)))
+    return figure
 
 # --- ファイルアップローダー ---
 st.sidebar.header("1. ファイルアップロード")
 st.sidebar.info("分析対象のCSVファイルを2つアップロードしてください。")
 uploaded_seisakubutsu_file = st.sidebar.file_uploader("制作物一覧 CSV", type="csv")
 uploaded_header_file = st.sidebar.file_uploader("ヘッダー一覧 CSV", type="csv")
+stream_header = st.sidebar.checkbox(
+    "ヘッダーCSVを分割読み込み（大容量向け）",
+    value=uploaded_header_file is not None and uploaded_header_file.size > STREAM_THRESHOLD_BYTES,
+    help="メモリ使用量を抑えるため、ヘッダーCSVを分割して読み込みます（読み込み時間はやや増えます）。"
+)
+uploaded_delta_files = st.sidebar.file_uploader(
+    "ヘッダー差分 CSV（任意・複数可）", type="csv", accept_multiple_files=True,
+    help="読み込み済みのヘッダー一覧に、新規・変更されたヘッダー行だけを反映します"
+         "（制作物トークン・担当者メールアドレス・作成日で行を対応させます）。"
+)
+uploaded_snapshot_file = None
+use_shared_store = False
+if HAS_PYARROW:
+    uploaded_snapshot_file = st.sidebar.file_uploader(
+        "前処理済みスナップショット（任意）", type="zip",
+        help="以前ダウンロードしたスナップショットを指定すると、CSVの再解析を省略します（CSVより優先）。"
+    )
+    use_shared_store = st.sidebar.checkbox(
+        "サーバー上の共有データを使う", value=shared_store_enabled_by_env(),
+        help="前処理済み（PII除去済み）のデータをサーバー上のファイルに置き、同じファイルを開く他の利用者と"
+             f"メモリを共有します（読み込みも2人目からは省略）。環境変数 {STORE_ENABLE_ENV}=1 で既定を有効にできます。"
+    )
+
+# --- 性能計測（任意） ---
+# 有効時は段階ごとの時間・行数・メモリを記録し、実行の最後にこの欄へ表示する
+# （tracemalloc はプロセス全体で共有されるため、同時に使う他セッションの割り当ても含む）
+profile_box = st.sidebar.expander("性能計測")
+profile_on = profile_box.checkbox("段階ごとの時間・メモリを記録する", value=profile_enabled_by_env(),
+                                  help=f"環境変数 {PROFILE_ENV}=1 で既定を有効にできます。")
+PROFILE_TRACE_KEY = '_profile_trace'
+# 前回の実行で終わらずに残った計測（途中での中断など）は、計測が有効かどうかに関わらずここで終える
+finish_trace(st.session_state.pop(PROFILE_TRACE_KEY, None))
+trace = start_trace() if profile_on else None
+if trace is not None:
+    st.session_state[PROFILE_TRACE_KEY] = trace
+
+def show_profile(trace):
+    """計測を終えて結果を「性能計測」欄に表示する（無効時は何もしない）"""
+    if trace is None:
+        return
+    finish_trace(trace)
+    with profile_box:
+        st.dataframe(
+            trace_frame(trace).rename(columns={'stage': '段階', 'wall_ms': 'ミリ秒', 'rows': '行数',
+                                               'peak_mb': 'ピークMB', 'deep_mb': 'データMB', 'rss_mb': 'RSS MB'}).round(1),
+            hide_index=True, use_container_width=True
+        )
+        st.caption(f"合計 {trace['total_ms']:.0f} ms")
+        st.download_button("⬇️ 計測結果（JSON）", data=partial(trace_json, trace),
+                           file_name='bpr_profile.json', mime='application/json')
 
-# --- データ読み込み（非キャッシュ） ---
-def load_data(seisakubutsu_file, header_file):
-    """アップロードCSVを読み込み、結合・前処理を行う（PIIは早期除去）"""
-    try:
-        # 文字コードはUTF-8系を優先
-        seisakubutsu_df = pd.read_csv(seisakubutsu_file, encoding='utf-8-sig')
-    except Exception:
-        try:
-            seisakubutsu_df = pd.read_csv(seisakubutsu_file, encoding='utf-8')
-        except Exception:
-            seisakubutsu_df = pd.read_csv(seisakubutsu_file)
+# --- データ読み込み ---
+# ingest の検証で見つけた不備（IngestError）はそのメッセージを表示し、
+# パーサー側の例外（pandas / pyarrow の ValueError）は内部の文言を見せずに共通の案内にする
+LOAD_ERROR_MESSAGE = "ファイルを読み込めませんでした。CSV（またはスナップショット）の形式・文字コードを確認してください。"
 
+def load_data(seisakubutsu_file, header_file, stream_header=False, delta_state=None):
+    """
+    アップロードCSVを読み込み、結合・前処理を行う（PIIは早期除去）
+    stream_header=True ならヘッダーCSVを分割読み込みする（ピークメモリを分割サイズで抑える）
+    delta_state（空のdict）を渡すと、ヘッダー差分の取り込みに使う状態を書き込む
+    """
+    progress = st.progress(0.0, text="読み込みを開始しています…")
     try:
-        header_df = pd.read_csv(header_file, encoding='utf-8-sig')
-    except Exception:
-        try:
-            header_df = pd.read_csv(header_file, encoding='utf-8')
-        except Exception:
-            header_df = pd.read_csv(header_file)
-
-    # 日付正規化
-    for col in ['作成日', '修正日', '締め切り日']:
-        if col in seisakubutsu_df.columns:
-            seisakubutsu_df[col] = pd.to_datetime(seisakubutsu_df[col], errors='coerce').dt.tz_localize(None)
-        if col in header_df.columns:
-            header_df[col] = pd.to_datetime(header_df[col], errors='coerce').dt.tz_localize(None)
-
-    # 列名整形 & チェック者数集計
-    header_df.rename(columns={'制作物トークン': 'トークン'}, inplace=True)
-    if '担当者メールアドレス' in header_df.columns:
-        checkers_count_df = header_df.groupby('トークン')['担当者メールアドレス'].nunique().reset_index()
-        checkers_count_df.rename(columns={'担当者メールアドレス': 'チェック者数'}, inplace=True)
-        # PIIは速やかに削除する場合は以下を有効化
-        # header_df = header_df.drop(columns=['担当者メールアドレス'])
-    else:
-        checkers_count_df = pd.DataFrame(columns=['トークン', 'チェック者数'])
-
-    # 制作物側へチェック者数を付与
-    if 'トークン' in seisakubutsu_df.columns:
-        seisakubutsu_df = pd.merge(seisakubutsu_df, checkers_count_df, on='トークン', how='left')
-        seisakubutsu_df['チェック者数'] = seisakubutsu_df['チェック者数'].fillna(0)
-    else:
-        seisakubutsu_df['チェック者数'] = 0
-
-    # 結合
-    if 'トークン' in header_df.columns and 'トークン' in seisakubutsu_df.columns:
-        merged_df = pd.merge(header_df, seisakubutsu_df, on='トークン',
-                             suffixes=('_header', '_seisakubutsu'))
-    else:
-        st.error("エラー: 双方のCSVに『トークン』列が必要です。")
-        return None, None
-
-    # 発刊月のカテゴリ
-    for df in (merged_df, seisakubutsu_df):
-        if '発刊月' in df.columns:
-            df['発刊月'] = pd.Categorical(df['発刊月'], categories=month_order, ordered=True)
-
-    # 実データに存在する工程のみ許容
-    existing_processes = pd.concat([
-        merged_df['工程'] if '工程' in merged_df.columns else pd.Series(dtype=str),
-        seisakubutsu_df['工程'] if '工程' in seisakubutsu_df.columns else pd.Series(dtype=str)
-    ]).dropna().unique()
-    filtered_process_order = [p for p in original_process_order if p in existing_processes]
-    for df in (merged_df, seisakubutsu_df):
-        if '工程' in df.columns:
-            df['工程'] = pd.Categorical(df['工程'], categories=filtered_process_order, ordered=True)
-
-    return merged_df, seisakubutsu_df
-
-# --- メイン処理 ---
-if uploaded_seisakubutsu_file is not None and uploaded_header_file is not None:
-    df_merged_all, df_seisakubutsu_all = load_data(uploaded_seisakubutsu_file, uploaded_header_file)
-    if df_merged_all is None:
-        st.stop()
-
-    st.sidebar.header("2. 絞り込みフィルター")
-    # 期間フィルター
-    if '作成日' not in df_seisakubutsu_all.columns or df_seisakubutsu_all['作成日'].dropna().empty:
-        st.error("エラー: 制作物CSVに『作成日』列がありません（または全て欠損）")
-        st.stop()
-
-    min_date = df_seisakubutsu_all['作成日'].min().date()
-    max_date = df_seisakubutsu_all['作成日'].max().date()
-    start_date = st.sidebar.date_input('開始日', min_date, min_value=min_date, max_value=max_date)
-    end_date = st.sidebar.date_input('終了日', max_date, min_value=start_date, max_value=max_date)
-
-    if start_date > end_date:
-        st.sidebar.error('エラー: 終了日は開始日以降に設定してください。')
-        st.stop()
-
-    start_datetime = pd.to_datetime(start_date)
-    end_datetime = pd.to_datetime(end_date) + pd.Timedelta(days=1)
-
-    # 期間適用（結合側は作成日_seisakubutsu）
-    date_col_merged = '作成日_seisakubutsu'
-    if date_col_merged not in df_merged_all.columns:
-        st.error("エラー: 結合後のデータに『作成日_seisakubutsu』がありません。入力CSVの列名をご確認ください。")
-        st.stop()
-
-    df_filtered_by_date = df_merged_all[
-        (df_merged_all[date_col_merged] >= start_datetime) &
-        (df_merged_all[date_col_merged] < end_datetime)
-    ].copy()
-    df_seisakubutsu_filtered_by_date = df_seisakubutsu_all[
-        (df_seisakubutsu_all['作成日'] >= start_datetime) &
-        (df_seisakubutsu_all['作成日'] < end_datetime)
-    ].copy()
-
-    # 発刊年度フィルター
-    st.sidebar.subheader("発刊年度フィルター")
-    available_years = sorted(df_seisakubutsu_filtered_by_date['年度'].dropna().unique().tolist()) \
-        if '年度' in df_seisakubutsu_filtered_by_date.columns else []
-    selected_year = st.sidebar.selectbox('比較したい発刊年度を選択', options=['すべて'] + available_years)
-
-    # 発刊月フィルター
-    st.sidebar.subheader("発刊月フィルター")
-    if '発刊月' in df_seisakubutsu_filtered_by_date.columns:
-        available_months = [m for m in month_order if m in df_seisakubutsu_filtered_by_date['発刊月'].dropna().unique()]
-    else:
-        available_months = []
-    selected_month = st.sidebar.selectbox('比較したい発刊月を選択', options=['すべて'] + available_months)
-
-    df_filtered_by_month = df_filtered_by_date.copy()
-    df_seisakubutsu_filtered_by_month = df_seisakubutsu_filtered_by_date.copy()
-    if selected_year != 'すべて' and '年度' in df_filtered_by_month.columns:
-        df_filtered_by_month = df_filtered_by_month[df_filtered_by_month['年度'] == selected_year]
-        df_seisakubutsu_filtered_by_month = df_seisakubutsu_filtered_by_month[df_seisakubutsu_filtered_by_month['年度'] == selected_year]
-    if selected_month != 'すべて' and '発刊月' in df_filtered_by_month.columns:
-        df_filtered_by_month = df_filtered_by_month[df_filtered_by_month['発刊月'] == selected_month]
-        df_seisakubutsu_filtered_by_month = df_seisakubutsu_filtered_by_month[df_seisakubutsu_filtered_by_month['発刊月'] == selected_month]
-
-    # 学年フィルター（★ここで「入学準備」を拾うように修正）
-    st.sidebar.subheader("学年フィルター")
-    grade_cols = [c for c in df_seisakubutsu_all.columns if ('年生' in c or '学年その他' in c or c == '入学準備')]
-
-    if grade_cols:
-        # melt → '対象' をブール解釈（'True','1','○' などもOK）
-        melted_grades = df_seisakubutsu_filtered_by_month.melt(
-            id_vars=['トークン'], value_vars=grade_cols, var_name='学年', value_name='対象'
+        merged_df, seisakubutsu_df, ingest_stats, memory_report = load_tables(
+            seisakubutsu_file.getvalue(), header_file.getvalue(), stream_header=stream_header,
+            on_progress=lambda frac, text: progress.progress(frac, text=text), delta_state=delta_state
         )
-        if not melted_grades.empty:
-            melted_grades['対象_bool'] = melted_grades['対象'].map(to_bool_like)
+    except IngestError as e:
+        st.error(f"エラー: {e}")
+        return None, None, None, None
+    except ValueError:
+        st.error(f"エラー: {LOAD_ERROR_MESSAGE}")
+        return None, None, None, None
+    finally:
+        progress.empty()
+    return strip_pii(merged_df), strip_pii(seisakubutsu_df), ingest_stats, memory_report
+
+def load_data_cached(seisakubutsu_file, header_file, stream_header=False):
+    """load_data の結果をアップロード内容のハッシュでセッション内キャッシュする"""
+    upload_key = upload_digest(seisakubutsu_file, header_file)
+    session_cache_reset(upload_key)
+    cached = session_cache_get('dataset')
+    if cached is not None:
+        session_cache_get('delta_state')  # 差分用の状態もデータセットと同じ間だけ保持する
+        return cached
+    # 読み込み直すときは、前の読み込み（反映済みの差分を含む）から作ったキューブ・索引を残さない
+    session_cache_drop('dataset')
+    delta_state = {}
+    result = load_data(seisakubutsu_file, header_file, stream_header, delta_state=delta_state)
+    if result[0] is None:
+        return result
+    session_cache_put('dataset', result)
+    session_cache_put('delta_state', {**delta_state, 'applied': []})
+    return result
+
+def load_snapshot(snapshot_file):
+    """スナップショットを読み込み、load_data と同じ形で返す"""
+    try:
+        merged_df, seisakubutsu_df, stats = read_snapshot(snapshot_file.getvalue())
+    except IngestError as e:
+        st.error(f"エラー: {e}")
+        return None, None, None, None
+    except ValueError:
+        st.error(f"エラー: {LOAD_ERROR_MESSAGE}")
+        return None, None, None, None
+    ingest_stats = pd.DataFrame([{'ファイル': 'スナップショット', **stats}])
+    # 行の並びは書き出し時のまま（結合側の制作物行が制作物側の行位置を指すため並べ替えない）。
+    # 列の型はここで揃え、トークンのコードを作り直す
+    merged_df, seisakubutsu_df, memory_report = compact_frames(strip_pii(merged_df), strip_pii(seisakubutsu_df))
+    return merged_df, seisakubutsu_df, ingest_stats, memory_report
+
+def load_snapshot_cached(snapshot_file):
+    """load_snapshot の結果をアップロード内容のハッシュでセッション内キャッシュする"""
+    upload_key = upload_digest(snapshot_file)
+    session_cache_reset(upload_key)
+    cached = session_cache_get('dataset')
+    if cached is not None:
+        return cached
+    session_cache_drop('dataset')
+    result = load_snapshot(snapshot_file)
+    if result[0] is None:
+        return result
+    session_cache_put('dataset', result)
+    return result
+
+# --- 共有データ（任意） ---
+# 前処理済みデータをサーバー上のArrowファイルとして公開し、各セッションはメモリマップで同じページを参照する。
+# セッション内キャッシュにはデータを持たない（索引・キューブもストア側で共有する）
+SHARED_OWNER_KEY = '_shared_owner'
+SHARED_DIGEST_KEY = '_shared_digest'
+
+def release_shared():
+    """このセッションが参照している共有データを手放す"""
+    digest = st.session_state.pop(SHARED_DIGEST_KEY, None)
+    if digest is not None:
+        release_dataset(digest, st.session_state.get(SHARED_OWNER_KEY))
+
+def load_shared(upload_files, load):
+    """
+    共有データを開く（未公開なら load() で読み込んでから公開する）。
+    戻り値: load_data と同じ形。公開時の取り込み統計に、このセッションでの展開時間の行を足す
+    """
+    digest = upload_digest(*upload_files)
+    # 共有データを使う間はセッション内キャッシュにデータを持たない
+    session_cache_reset(digest)
+    if st.session_state.get(CACHE_STATE_KEY):
+        st.session_state[CACHE_STATE_KEY] = {}
+        gc.collect()
+    owner = st.session_state.setdefault(SHARED_OWNER_KEY, secrets.token_hex(8))
+    if st.session_state.get(SHARED_DIGEST_KEY) not in (None, digest):
+        release_shared()
+    t0 = time.perf_counter()
+    opened = acquire_dataset(digest, owner)
+    if opened is None:
+        merged_df, seisakubutsu_df, ingest_stats, memory_report = load()
+        if merged_df is None:
+            return None, None, None, None
+        # ヘッダー行キーはセッションごとの鍵によるもので共有しない
+        publish_dataset(digest, merged_df.drop(columns=[ROW_KEY_COL], errors='ignore'), seisakubutsu_df,
+                        {'ingest_stats': ingest_stats.to_dict('records'), 'memory_report': memory_report.to_dict('list')})
+        del merged_df, seisakubutsu_df
+        t0 = time.perf_counter()
+        opened = acquire_dataset(digest, owner)
+        if opened is None:
+            st.error("エラー: 共有データを開けませんでした。")
+            return None, None, None, None
+    st.session_state[SHARED_DIGEST_KEY] = digest
+    merged_df, seisakubutsu_df, meta = opened
+    seconds = time.perf_counter() - t0
+    rows = len(merged_df) + len(seisakubutsu_df)
+    ingest_stats = pd.DataFrame(meta.get('ingest_stats', []) + [{
+        'ファイル': '共有データ', 'encoding': '-', 'engine': 'arrow(mmap)', 'rows': rows, 'seconds': seconds,
+        'rows_per_sec': (rows / seconds) if seconds > 0 else 0.0,
+    }])
+    return merged_df, seisakubutsu_df, ingest_stats, pd.DataFrame(meta['memory_report'])
+
+def dataset_cache(name, build):
+    """データから導く索引・集計のキャッシュ（共有データならストア側で共有、それ以外はセッション内）"""
+    digest = st.session_state.get(SHARED_DIGEST_KEY)
+    if digest is not None:
+        return shared_derived(digest, name, build)
+    cached = session_cache_get(name)
+    if cached is None:
+        cached = build()
+        session_cache_put(name, cached)
+    return cached
+
+def get_name_index(seisakubutsu_df):
+    """
+    制作物名の語彙とコード配列（制作物の行単位）。データセットごとに1回だけ作成
+    （結合側の行は制作物行からこのコードを引く）
+    """
+    def build():
+        vocab, (sei_codes,) = build_name_codes(seisakubutsu_df['制作物名'])
+        return {'vocab': vocab, 'sei_codes': sei_codes}
+    return dataset_cache('name_index', build)
+
+def get_grade_bits(seisakubutsu_df, grade_cols):
+    """学年ビットマスク（制作物の行単位）。データセットごとに1回だけ作成"""
+    return dataset_cache('grade_bits', lambda: build_grade_bits(seisakubutsu_df, grade_cols))
+
+def delta_version(state):
+    """表の版（読み込みごとの鍵と反映済みの差分）。差分用の状態が無ければ None"""
+    if state is None or 'hash_key' not in state:
+        return None
+    return state['hash_key'], tuple(state['applied'])
+
+def get_cube(merged_df, seisakubutsu_df, grade_bits, grade_cols):
+    """
+    期間を全体にしたときの行（作成日が欠損でない行）の集計キューブ。データセットごとに1回だけ作成。
+    戻り値: analytics.build_cube_entry の形（版が今の表と違うキャッシュは作り直す）
+    """
+    version = delta_version(session_cache_get('delta_state'))
+    def build():
+        return build_cube_entry(merged_df, seisakubutsu_df, grade_bits.to_numpy(), grade_cols, version)
+    entry = dataset_cache('cube', build)
+    if entry['version'] != version:
+        session_cache_drop('cube')
+        entry = dataset_cache('cube', build)
+    return entry
+
+def apply_deltas_cached(delta_files, dataset):
+    """
+    未反映のヘッダー差分CSVをアップロード順に反映し、キャッシュ中のデータセットを置き換える。
+    集計キューブは差分の行だけで更新する（学年ビットマスク・制作物名索引は制作物側の行が変わらないのでそのまま）。
+    """
+    state = session_cache_get('delta_state')
+    pending = [f for f in delta_files if state is None or upload_digest(f) not in state['applied']]
+    if not pending:
+        return dataset
+    if state is None or 'pairs' not in state:
+        st.sidebar.warning("このデータにはヘッダー差分を反映できません（2つのCSVから読み込んだデータのみ対応・共有データは対象外）。")
+        return dataset
+    merged_df, seisakubutsu_df, ingest_stats, memory_report = dataset
+    for f in pending:
+        before = delta_version(state)
+        try:
+            merged_df, seisakubutsu_df, delta = apply_header_delta(merged_df, seisakubutsu_df, f.getvalue(), state)
+        except IngestError as e:
+            st.sidebar.error(f"{f.name}: {e}")
+            continue
+        except ValueError:
+            st.sidebar.error(f"{f.name}: {LOAD_ERROR_MESSAGE}")
+            continue
+        state['applied'].append(upload_digest(f))
+        stats = delta['stats']
+        ingest_stats = pd.concat([ingest_stats, pd.DataFrame([{
+            'ファイル': f"差分: {f.name}", 'kept_rows': stats['replaced_rows'] + stats['appended_rows'],
+            **{k: stats[k] for k in ('encoding', 'engine', 'rows', 'seconds', 'rows_per_sec')},
+        }])], ignore_index=True)
+        if stats['row_id'] is None:
+            st.sidebar.success(f"{f.name}: 行ごとのID列が無いため、{stats['appended_rows']:,} 行を追加しました。")
         else:
-            melted_grades['対象_bool'] = pd.Series(dtype=bool)
-        relevant_grades = melted_grades[melted_grades['対象_bool'] == True]
-        available_grades = relevant_grades['学年'].unique().tolist()
-    else:
-        melted_grades = pd.DataFrame(columns=['トークン', '学年', '対象', '対象_bool'])
-        relevant_grades = pd.DataFrame(columns=['トークン', '学年'])
-        available_grades = []
-
-    selected_grades = st.sidebar.multiselect('分析したい学年を選択', options=available_grades, default=available_grades)
-
-    if selected_grades and not relevant_grades.empty:
-        selected_tokens = relevant_grades[relevant_grades['学年'].isin(selected_grades)]['トークン'].unique()
-        df_filtered = df_filtered_by_month[df_filtered_by_month['トークン'].isin(selected_tokens)].copy()
-        df_seisakubutsu_filtered = df_seisakubutsu_filtered_by_month[df_seisakubutsu_filtered_by_month['トークン'].isin(selected_tokens)].copy()
-    else:
-        df_filtered = pd.DataFrame(columns=df_filtered_by_month.columns)
-        df_seisakubutsu_filtered = pd.DataFrame(columns=df_seisakubutsu_filtered_by_month.columns)
-
-    # 制作物名フィルター
-    st.sidebar.subheader("制作物名フィルター")
-    name_filter_text = st.sidebar.text_input('制作物名に含まれるテキストで絞り込み')
-    if name_filter_text and '制作物名' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['制作物名'].str.contains(name_filter_text, na=False)].copy()
-        df_seisakubutsu_filtered = df_seisakubutsu_filtered[df_seisakubutsu_filtered['制作物名'].str.contains(name_filter_text, na=False)].copy()
-
-    # ダウンロード
-    st.sidebar.header("3. ダウンロード")
-    if not df_filtered.empty:
-        output = io.BytesIO()
-        df_filtered.to_csv(output, index=False, encoding='utf-8-sig')  # Excel互換
-        st.sidebar.text("フィルター後の統合CSVをダウンロード")
-        st.sidebar.download_button(
-            label="⬇️ ダウンロード",
-            data=output.getvalue(),
-            file_name='filtered_data.csv',
-            mime='text/csv'
-        )
-        del output
-
-    # 表示ガード
-    if df_filtered.empty:
-        st.warning("選択された条件に該当するデータはありません。フィルター条件を変更してください。")
-        st.stop()
-
-    # サマリー
-    unique_items = df_seisakubutsu_filtered['制作物名'].nunique() if '制作物名' in df_seisakubutsu_filtered.columns else 0
-    st.success(f"データ読み込み完了。現在 {unique_items} 件の制作物データを分析中です。")
-
-    processes_for_tabs = [p for p in original_process_order
-                          if '工程' in df_filtered.columns and p in df_filtered['工程'].unique()]
-
-    # --- 全体サマリー ---
-    st.text("")
-    st.header("📊 全体サマリー")
-    st.markdown("フィルターで絞り込んだデータ全体の概要（学年別・合計）と、発刊月ごとの推移を確認できます。")
-
-    # 学年別サマリー
-    if not relevant_grades.empty:
-        df_filtered_with_grade_summary = pd.merge(
-            df_filtered, relevant_grades[['トークン', '学年']].drop_duplicates(),
-            on='トークン', how='left'
-        )
-        df_seisakubutsu_with_grade_summary = pd.merge(
-            df_seisakubutsu_filtered, relevant_grades[['トークン', '学年']].drop_duplicates(),
-            on='トークン', how='left'
-        )
-
-        summary_items = df_seisakubutsu_with_grade_summary.groupby('学年', observed=True)['制作物名'].nunique().rename('総制作物件数') \
-            if '制作物名' in df_seisakubutsu_with_grade_summary.columns else pd.Series(dtype='float64')
-        summary_processes = df_seisakubutsu_with_grade_summary.groupby('学年', observed=True).size().rename('総工程数')
-
-        # 期限内完了率の計算（必要列が揃っているかチェック）
-        need_cols = {'チェック済み', '修正日_header', '締め切り日'}
-        if has_cols(df_filtered_with_grade_summary, need_cols):
-            completed = safe_bool_series(df_filtered_with_grade_summary, 'チェック済み') \
-                .groupby(df_filtered_with_grade_summary['学年'], observed=True).sum().rename('completed')
-            ontime_mask = safe_bool_series(df_filtered_with_grade_summary, 'チェック済み') & \
-                          (df_filtered_with_grade_summary['修正日_header'] <= df_filtered_with_grade_summary['締め切り日'])
-            ontime = ontime_mask.groupby(df_filtered_with_grade_summary['学年'], observed=True).sum().rename('on_time')
-            on_time_summary = pd.concat([completed, ontime], axis=1)
-            num_fillna_inplace(on_time_summary, 0)
-            on_time_summary['期限内完了率(%)'] = (
-                (on_time_summary.get('on_time', 0) / on_time_summary.get('completed', 0).replace(0, pd.NA)) * 100
-            ).fillna(0)
+            st.sidebar.success(f"{f.name}: {stats['replaced_rows']:,} 行を置き換え、{stats['appended_rows']:,} 行を追加しました。")
+
+        # キューブは差分を当てる前の表から作ったものだけを更新する（版が違えば捨てて作り直させる）
+        cube_entry = session_cache_get('cube')
+        grade_bits = session_cache_get('grade_bits')
+        if cube_entry is not None and grade_bits is not None:
+            cube_entry = cube_entry_apply_delta(cube_entry, merged_df, seisakubutsu_df, grade_bits, delta,
+                                                before, delta_version(state))
+        if cube_entry is not None and grade_bits is not None:
+            session_cache_put('cube', cube_entry)
         else:
-            on_time_summary = pd.DataFrame({'期限内完了率(%)': []})
+            session_cache_drop('cube')
+    dataset = (merged_df, seisakubutsu_df, ingest_stats, memory_report)
+    session_cache_put('dataset', dataset)
+    session_cache_put('delta_state', state)
+    return dataset
 
-        # 平均チェック者数
-        if has_cols(df_seisakubutsu_with_grade_summary, {'学年', 'トークン', 'チェック者数'}):
-            avg_checkers = df_seisakubutsu_with_grade_summary.drop_duplicates(subset=['学年', 'トークン']) \
-                .groupby('学年', observed=True)['チェック者数'].mean().rename('平均チェック者数(人)')
+# --- メイン処理 ---
+# 計測は st.stop() や中断で途中で抜けても必ず終える
+try:
+    if uploaded_snapshot_file is not None or (uploaded_seisakubutsu_file is not None and uploaded_header_file is not None):
+        if use_shared_store:
+            if uploaded_snapshot_file is not None:
+                df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report = load_shared(
+                    [uploaded_snapshot_file], partial(load_snapshot, uploaded_snapshot_file)
+                )
+            else:
+                df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report = load_shared(
+                    [uploaded_seisakubutsu_file, uploaded_header_file],
+                    partial(load_data, uploaded_seisakubutsu_file, uploaded_header_file, stream_header)
+                )
+        elif uploaded_snapshot_file is not None:
+            release_shared()
+            df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report = load_snapshot_cached(uploaded_snapshot_file)
         else:
-            avg_checkers = pd.Series(dtype='float64', name='平均チェック者数(人)')
-
-        summary_by_grade_df = pd.concat(
-            [summary_items, summary_processes, on_time_summary.get('期限内完了率(%)', pd.Series(dtype='float64')), avg_checkers],
-            axis=1
-        ).reset_index()
-
-        num_fillna_inplace(summary_by_grade_df, 0)
-
-        # 全体合計
-        total_items = df_seisakubutsu_filtered['制作物名'].nunique() if '制作物名' in df_seisakubutsu_filtered.columns else 0
-        total_processes = len(df_seisakubutsu_filtered)
-        if has_cols(df_filtered, {'チェック済み', '修正日_header', '締め切り日'}):
-            total_completed = int(safe_bool_series(df_filtered, 'チェック済み').sum())
-            total_on_time = int((safe_bool_series(df_filtered, 'チェック済み') &
-                                (df_filtered['修正日_header'] <= df_filtered['締め切り日'])).sum())
-            total_on_time_rate = (total_on_time / total_completed * 100) if total_completed > 0 else 0
+            release_shared()
+            df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report = load_data_cached(
+                uploaded_seisakubutsu_file, uploaded_header_file, stream_header=stream_header
+            )
+        if df_merged_all is None:
+            st.stop()
+        if uploaded_delta_files:
+            df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report = apply_deltas_cached(
+                uploaded_delta_files, (df_merged_all, df_seisakubutsu_all, ingest_stats, memory_report)
+            )
+        mark(trace, '読み込み', rows=len(df_merged_all), frame=df_merged_all)
+
+        with st.sidebar.expander("読み込み性能"):
+            st.dataframe(
+                ingest_stats.rename(columns={'encoding': '文字コード', 'engine': 'エンジン', 'rows': '行数',
+                                             'seconds': '秒', 'rows_per_sec': '行/秒', 'prep_seconds': '整形秒',
+                                             'date_formats': '日付書式', 'date_fallback': '個別解釈件数',
+                                             'kept_rows': '保持行数'}).round(3),
+                hide_index=True, use_container_width=True
+            )
+            # 列圧縮の効果（memory_usage(deep=True)）
+            memory_view = memory_report.assign(
+                table=memory_report['table'].map({'merged': '結合データ', 'seisakubutsu': '制作物一覧'}),
+                before_mb=memory_report['before_bytes'] / 2**20,
+                after_mb=memory_report['after_bytes'] / 2**20,
+                reduction=(1 - memory_report['after_bytes'] / memory_report['before_bytes'].clip(lower=1)) * 100,
+            )[['table', 'before_mb', 'after_mb', 'reduction']]
+            st.dataframe(
+                memory_view.rename(columns={'table': 'テーブル', 'before_mb': '圧縮前MB', 'after_mb': '圧縮後MB',
+                                            'reduction': '削減率(%)'}).round(2),
+                hide_index=True, use_container_width=True
+            )
+            if use_shared_store:
+                st.caption("共有データ（refs: 参照中のセッション数）")
+                st.dataframe(store_status().round(1), hide_index=True, use_container_width=True)
+
+        st.sidebar.header("2. 絞り込みフィルター")
+        # 期間フィルター
+        if '作成日' not in df_seisakubutsu_all.columns or df_seisakubutsu_all['作成日'].dropna().empty:
+            st.error("エラー: 制作物CSVに『作成日』列がありません（または全て欠損）")
+            st.stop()
+
+        min_date = df_seisakubutsu_all['作成日'].min().date()
+        max_date = df_seisakubutsu_all['作成日'].max().date()
+        start_date = st.sidebar.date_input('開始日', min_date, min_value=min_date, max_value=max_date)
+        end_date = st.sidebar.date_input('終了日', max_date, min_value=start_date, max_value=max_date)
+
+        if start_date > end_date:
+            st.sidebar.error('エラー: 終了日は開始日以降に設定してください。')
+            st.stop()
+
+        start_datetime = pd.to_datetime(start_date)
+        end_datetime = pd.to_datetime(end_date) + pd.Timedelta(days=1)
+
+        # 期間は作成日でソート済みの制作物側を二分探索し、連続区間として切り出す（コピーなし）。
+        # 結合側は制作物行の順に並んでいるので、その区間を参照する行も連続区間になる
+        s_lo, s_hi = date_slice(df_seisakubutsu_all['作成日'], start_datetime, end_datetime)
+        m_lo, m_hi = linked_slice(df_merged_all, s_lo, s_hi)
+        df_merged_win = df_merged_all.iloc[m_lo:m_hi]
+        df_seisakubutsu_win = df_seisakubutsu_all.iloc[s_lo:s_hi]
+
+        # 以降のフィルターは制作物側の属性だけに掛かるので、制作物側の1本のブールマスクへ合成し、
+        # 結合側のマスクは最後に制作物行から引く（途中段階のDataFrameを作らない。選択肢の算出は必要な列だけを参照）
+        sei_mask = np.ones(s_hi - s_lo, dtype=bool)
+        mark(trace, '期間フィルター', rows=m_hi - m_lo)
+
+        # 発刊年度フィルター
+        st.sidebar.subheader("発刊年度フィルター")
+        available_years = sorted(df_seisakubutsu_win['年度'][sei_mask].dropna().unique().tolist()) \
+            if '年度' in df_seisakubutsu_win.columns else []
+        selected_year = st.sidebar.selectbox('比較したい発刊年度を選択', options=['すべて'] + available_years)
+
+        # 発刊月フィルター
+        st.sidebar.subheader("発刊月フィルター")
+        if '発刊月' in df_seisakubutsu_win.columns:
+            present_months = set(df_seisakubutsu_win['発刊月'][sei_mask].dropna().unique())
+            available_months = [m for m in MONTH_ORDER if m in present_months]
         else:
-            total_on_time_rate = 0
-        total_avg_checkers = df_seisakubutsu_filtered.drop_duplicates(subset=['トークン'])['チェック者数'].mean() \
-            if 'チェック者数' in df_seisakubutsu_filtered.columns else 0
-
-        total_summary_df = pd.DataFrame([{
-            '学年': '合計',
-            '総制作物件数': total_items,
-            '総工程数': total_processes,
-            '期限内完了率(%)': total_on_time_rate,
-            '平均チェック者数(人)': total_avg_checkers
-        }])
-
-        final_summary_df = pd.concat([summary_by_grade_df, total_summary_df], ignore_index=True)
-        num_fillna_inplace(final_summary_df, 0)
-        for col in ['総制作物件数', '総工程数']:
-            if col in final_summary_df.columns:
-                final_summary_df[col] = final_summary_df[col].astype(int)
-        final_summary_df = final_summary_df.round(1)
-
-        st.subheader("学年別サマリー")
-        show_cols = ['学年', '総制作物件数', '総工程数', '期限内完了率(%)', '平均チェック者数(人)']
-        st.dataframe(final_summary_df[[c for c in show_cols if c in final_summary_df.columns]],
-                     use_container_width=True)
-    else:
-        st.info("学年データがないため、学年別サマリーは表示できません。")
-
-    st.markdown("---")
-
-    # 発刊月の推移
-    st.subheader("発刊月ごとの推移")
-    if not relevant_grades.empty and '発刊月' in df_seisakubutsu_filtered.columns:
-        monthly_by_grade = df_seisakubutsu_with_grade_summary.groupby(['発刊月', '学年'], observed=True).agg(
-            制作物件数=('制作物名', 'nunique') if '制作物名' in df_seisakubutsu_with_grade_summary.columns else ('学年', 'size'),
-            総工程数=('トークン', 'size')
-        ).reset_index()
-
-        monthly_total = df_seisakubutsu_filtered.groupby('発刊月', observed=True).agg(
-            制作物件数=('制作物名', 'nunique') if '制作物名' in df_seisakubutsu_filtered.columns else ('トークン', 'size'),
-            総工程数=('トークン', 'size')
-        ).reset_index()
-        monthly_total['学年'] = '合計'
-
-        monthly_summary = pd.concat([monthly_by_grade, monthly_total], ignore_index=True)
-        monthly_summary['発刊月'] = pd.Categorical(monthly_summary['発刊月'], categories=month_order, ordered=True)
-        monthly_summary_for_graph = monthly_summary[monthly_summary['発刊月'] != 'その他'].copy().sort_values('発刊月')
-
-        if not monthly_summary_for_graph.empty:
-            col1, col2 = st.columns(2)
-            with col1:
-                fig_a = px.line(monthly_summary_for_graph, x='発刊月', y='制作物件数', color='学年',
-                                title='発刊月ごとの制作物件数', markers=True,
-                                color_discrete_sequence=px.colors.qualitative.T10)
-                fig_a.update_layout(xaxis_title=None, legend_title_text='学年')
-                fig_a.update_xaxes(categoryorder='array', categoryarray=[m for m in month_order if m != 'その他'])
-                st.plotly_chart(fig_a, use_container_width=True)
-            with col2:
-                fig_b = px.line(monthly_summary_for_graph, x='発刊月', y='総工程数', color='学年',
-                                title='発刊月ごとの総工程数', markers=True,
-                                color_discrete_sequence=px.colors.qualitative.T10)
-                fig_b.update_layout(xaxis_title=None, legend_title_text='学年')
-                fig_b.update_xaxes(categoryorder='array', categoryarray=[m for m in month_order if m != 'その他'])
-                st.plotly_chart(fig_b, use_container_width=True)
+            available_months = []
+        selected_month = st.sidebar.selectbox('比較したい発刊月を選択', options=['すべて'] + available_months)
+
+        if selected_year != 'すべて' and '年度' in df_seisakubutsu_win.columns:
+            sei_mask &= as_mask(df_seisakubutsu_win['年度'] == selected_year)
+        if selected_month != 'すべて' and '発刊月' in df_seisakubutsu_win.columns:
+            sei_mask &= as_mask(df_seisakubutsu_win['発刊月'] == selected_month)
+        mark(trace, '年度・発刊月フィルター', rows=sei_mask.sum())
+
+        # 学年フィルター（★ここで「入学準備」を拾うように修正）
+        st.sidebar.subheader("学年フィルター")
+        grade_cols = [c for c in df_seisakubutsu_all.columns if is_grade_col(c)]
+
+        month_tokens = df_seisakubutsu_win['トークン'].to_numpy()[sei_mask]
+        if grade_cols:
+            # 読み込み時に作った学年ビットマスクから (トークン, 学年) 表を作る（meltしない）
+            grade_bits_all = get_grade_bits(df_seisakubutsu_all, grade_cols)
+            month_bits = grade_bits_all.to_numpy()[s_lo:s_hi][sei_mask]
+            relevant_grades = grade_pairs(month_tokens, month_bits, grade_cols)
+            available_grades = grades_in_mask(grade_cols, union_mask(month_bits))
         else:
-            st.info("発刊月ごとの集計データがありません。")
-    else:
-        st.info("学年データがないため、発刊月ごとの推移は表示できません。")
+            month_bits = None
+            relevant_grades = pd.DataFrame(columns=['トークン', '学年'])
+            available_grades = []
 
-    # --- 工程別 統合分析 ---
-    st.text("")
-    st.header("📊 工程別 統合分析ダッシュボード")
-    st.markdown("各工程のパフォーマンスと詳細分析を、以下のタブで切り替えて確認できます。")
+        selected_grades = st.sidebar.multiselect('分析したい学年を選択', options=available_grades, default=available_grades)
 
-    df_performance = pd.DataFrame()
-    if not df_filtered.empty and not relevant_grades.empty and '工程' in df_filtered.columns:
-        df_filtered_with_grade = pd.merge(
-            df_filtered, relevant_grades[['トークン', '学年']].drop_duplicates(), on='トークン', how='left'
-        )
-        df_seisakubutsu_with_grade = pd.merge(
-            df_seisakubutsu_filtered, relevant_grades[['トークン', '学年']].drop_duplicates(), on='トークン', how='left'
-        )
-
-        active_processes = processes_for_tabs
-        if selected_grades and active_processes:
-            scaffold_df = pd.MultiIndex.from_product([selected_grades, active_processes],
-                                                     names=['学年', '工程']).to_frame(index=False)
-
-            total_process_count_df = df_seisakubutsu_with_grade.groupby(['学年', '工程'], observed=True).size() \
-                .rename('総工程数').reset_index()
-
-            # 期限内完了率（列存在チェック）
-            if has_cols(df_filtered_with_grade, {'チェック済み', '修正日_header', '締め切り日'}):
-                completed_g = safe_bool_series(df_filtered_with_grade, 'チェック済み') \
-                    .groupby([df_filtered_with_grade['学年'], df_filtered_with_grade['工程']], observed=True).sum() \
-                    .rename('completed_count')
-
-                ontime_mask = safe_bool_series(df_filtered_with_grade, 'チェック済み') & \
-                              (df_filtered_with_grade['修正日_header'] <= df_filtered_with_grade['締め切り日'])
-                ontime_g = ontime_mask.groupby([df_filtered_with_grade['学年'], df_filtered_with_grade['工程']], observed=True) \
-                    .sum().rename('on_time_count')
-
-                on_time_rate_df = pd.concat([completed_g, ontime_g], axis=1).reset_index()
-                # 数値列のみ埋める
-                for col in ['completed_count', 'on_time_count']:
-                    if col in on_time_rate_df.columns:
-                        on_time_rate_df[col] = on_time_rate_df[col].fillna(0).astype(int)
-
-                if {'completed_count', 'on_time_count'}.issubset(on_time_rate_df.columns):
-                    denom = on_time_rate_df['completed_count'].replace(0, pd.NA)
-                    on_time_rate_df['期限内完了率(%)'] = (on_time_rate_df['on_time_count'] / denom * 100).fillna(0)
-                else:
-                    on_time_rate_df['期限内完了率(%)'] = 0
-
-                on_time_rate_df['期限内完了率(%)'] = on_time_rate_df['期限内完了率(%)'] \
-                    .replace([float('inf'), -float('inf')], 0)
+        if selected_grades and not relevant_grades.empty:
+            selected_mask = grade_mask_of(grade_cols, selected_grades)
+            selected_tokens = pd.unique(month_tokens[(month_bits & selected_mask) != 0])
+            sei_mask &= as_mask(df_seisakubutsu_win['トークン'].isin(selected_tokens))
+        else:
+            sei_mask[:] = False
+        mark(trace, '学年フィルター', rows=sei_mask.sum())
+
+        # 制作物名フィルター
+        st.sidebar.subheader("制作物名フィルター")
+        name_filter_text = st.sidebar.text_input('制作物名に含まれるテキストで絞り込み')
+        if name_filter_text and '制作物名' in df_seisakubutsu_win.columns:
+            # ユニークな制作物名だけを文字列として部分一致検索し、コードで行へ展開
+            name_index = get_name_index(df_seisakubutsu_all)
+            name_hit = match_names(name_index['vocab'], name_filter_text)
+            sei_mask &= rows_matching(name_index['sei_codes'][s_lo:s_hi], name_hit)
+        # 結合側の行は参照先の制作物行と同じ属性なので、制作物側のマスクをそのまま引く
+        merged_mask = sei_mask[df_merged_win[SEI_ROW_COL].to_numpy() - s_lo]
+        mark(trace, '制作物名フィルター', rows=merged_mask.sum())
+
+        # 期間が全体で制作物名の絞り込みがなければ、サマリー・推移・工程別指標は集計キューブから求める
+        cube = None
+        if grade_cols and selected_grades and not name_filter_text:
+            cube_entry = get_cube(df_merged_all, df_seisakubutsu_all, grade_bits_all, grade_cols)
+            if cube_entry['cube'] is not None and cube_entry['window'] == (m_lo, m_hi, s_lo, s_hi):
+                cube = cube_slice(cube_entry['cube'],
+                                  year=None if selected_year == 'すべて' else selected_year,
+                                  month=None if selected_month == 'すべて' else selected_month,
+                                  grade_mask=grade_mask_of(grade_cols, selected_grades))
+        mark(trace, '集計キューブ', rows=0 if cube is None else len(cube['merged']))
+
+        # マスクを1回だけ適用（ここで初めて行を取り出す）
+        df_filtered = df_merged_win[merged_mask]
+        df_seisakubutsu_filtered = df_seisakubutsu_win[sei_mask]
+        mark(trace, '行の取り出し', rows=len(df_filtered), frame=df_filtered)
+
+        # ダウンロード
+        st.sidebar.header("3. ダウンロード")
+        if not df_filtered.empty:
+            # 書き出しはクリック時のみ（再実行ごとにCSV全体を作らない）
+            st.sidebar.text("フィルター後の統合データをダウンロード")
+            export_formats = [f for f in EXPORT_FORMATS if f != 'parquet' or HAS_PYARROW]
+            export_format = st.sidebar.selectbox('形式', options=export_formats,
+                                                 format_func=lambda f: EXPORT_FORMATS[f][0])
+            # 制作物側の列は書き出し時に付ける。ヘッダー行キー・制作物行は内部列なので書き出さない
+            exportable_columns = [c for c in join_seisakubutsu(df_filtered.iloc[:0], df_seisakubutsu_all).columns
+                                  if c not in (ROW_KEY_COL, SEI_ROW_COL)]
+            export_columns = st.sidebar.multiselect('出力する列（未選択ならすべて）', options=exportable_columns)
+            _, export_name, export_mime = EXPORT_FORMATS[export_format]
+            st.sidebar.download_button(
+                label="⬇️ ダウンロード",
+                data=partial(export_joined, df_filtered, df_seisakubutsu_all, export_format,
+                             export_columns or exportable_columns),
+                file_name=export_name,
+                mime=export_mime
+            )
+        if HAS_PYARROW:
+            # 前処理済み全データ（PII除去済み）。生成はクリック時のみ
+            st.sidebar.text("前処理済みスナップショット（Parquet）をダウンロード")
+            st.sidebar.download_button(
+                label="⬇️ スナップショット",
+                data=partial(write_snapshot, df_merged_all, df_seisakubutsu_all),
+                file_name='bpr_snapshot.zip',
+                mime='application/zip'
+            )
+        mark(trace, 'ダウンロード', rows=len(df_filtered))
+
+        # 表示ガード
+        if df_filtered.empty:
+            st.warning("選択された条件に該当するデータはありません。フィルター条件を変更してください。")
+            show_profile(trace)
+            st.stop()
+
+        # 以降の集計で使う制作物側の列だけを、絞り込み後の行に制作物行から付ける
+        # （キューブで集計するなら、工程タブで使う列だけ）
+        df_filtered = join_seisakubutsu(df_filtered, df_seisakubutsu_all,
+                                        ['トークン', '工程'] if cube is not None else ROW_ATTR_COLS)
+        mark(trace, '制作物側の列', rows=len(df_filtered))
+
+        # サマリー
+        unique_items = df_seisakubutsu_filtered['制作物名'].nunique() if '制作物名' in df_seisakubutsu_filtered.columns else 0
+        st.success(f"データ読み込み完了。現在 {unique_items} 件の制作物データを分析中です。")
+
+        processes_for_tabs = [p for p in PROCESS_ORDER
+                              if '工程' in df_filtered.columns and p in df_filtered['工程'].unique()]
+
+        # --- 全体サマリー ---
+        st.text("")
+        st.header("📊 全体サマリー")
+        st.markdown("フィルターで絞り込んだデータ全体の概要（学年別・合計）と、発刊月ごとの推移を確認できます。")
+
+        # 集計元（キューブが使えればキューブ、なければ絞り込み後の行データ）。サマリー・推移・工程別で共用
+        if not relevant_grades.empty:
+            source = cube_source(cube) if cube is not None else \
+                row_source(df_filtered, df_seisakubutsu_filtered, relevant_grades)
+
+        # 学年別サマリー
+        if not relevant_grades.empty:
+            st.subheader("学年別サマリー")
+            st.dataframe(summary_table(source), use_container_width=True)
+        else:
+            st.info("学年データがないため、学年別サマリーは表示できません。")
+        mark(trace, 'サマリー', rows=len(df_filtered))
+
+        st.markdown("---")
+
+        # 発刊月の推移
+        st.subheader("発刊月ごとの推移")
+        if not relevant_grades.empty and '発刊月' in df_seisakubutsu_filtered.columns:
+            monthly_summary_for_graph = monthly_table(source)
+            if not monthly_summary_for_graph.empty:
+                for col, fig in zip(st.columns(2), cached_figure(monthly_figures, monthly_summary_for_graph)):
+                    with col:
+                        st.plotly_chart(fig, use_container_width=True)
             else:
-                on_time_rate_df = pd.DataFrame(columns=['学年', '工程', '期限内完了率(%)'])
-
-            # 平均チェック者数
-            if has_cols(df_filtered_with_grade, {'学年', '工程', 'トークン', 'チェック者数'}):
-                avg_checkers_df = df_filtered_with_grade[['学年', '工程', 'トークン', 'チェック者数']] \
-                    .drop_duplicates().groupby(['学年', '工程'], observed=True)['チェック者数'] \
-                    .mean().rename('平均チェック者数(人)').reset_index()
+                st.info("発刊月ごとの集計データがありません。")
+        else:
+            st.info("学年データがないため、発刊月ごとの推移は表示できません。")
+        mark(trace, '発刊月の推移', rows=len(df_seisakubutsu_filtered))
+
+        # --- 工程別 統合分析 ---
+        st.text("")
+        st.header("📊 工程別 統合分析ダッシュボード")
+        st.markdown("各工程のパフォーマンスと詳細分析を、以下の工程ボタンで切り替えて確認できます。")
+
+        df_performance = pd.DataFrame()
+        if not df_filtered.empty and not relevant_grades.empty and '工程' in df_filtered.columns:
+            active_processes = processes_for_tabs
+            if selected_grades and active_processes:
+                # 学年×工程の全組み合わせへ直接展開（該当なしは0）
+                df_performance = performance_table(source, selected_grades, active_processes)
+        mark(trace, '工程別指標', rows=len(df_performance))
+
+        if processes_for_tabs:
+            # 選択中の工程だけを計算・描画する（タブは全工程の中身を毎回実行してしまうため）
+            process_name = st.segmented_control('表示する工程', options=processes_for_tabs,
+                                                default=processes_for_tabs[0], key='active_process')
+            if process_name not in processes_for_tabs:
+                process_name = processes_for_tabs[0]
+            df_proc = df_filtered[df_filtered.get('工程') == process_name].copy() \
+                if '工程' in df_filtered.columns else pd.DataFrame()
+            df_proc_sei = df_seisakubutsu_filtered[df_seisakubutsu_filtered.get('工程') == process_name].copy() \
+                if '工程' in df_seisakubutsu_filtered.columns else pd.DataFrame()
+
+            if df_proc.empty:
+                st.info("この工程に関するデータはありません。")
             else:
-                avg_checkers_df = pd.DataFrame(columns=['学年', '工程', '平均チェック者数(人)'])
-
-            # 結合して数値列のみNA埋め
-            df_performance = scaffold_df.merge(total_process_count_df, on=['学年', '工程'], how='left') \
-                                        .merge(on_time_rate_df[['学年', '工程', '期限内完了率(%)']], on=['学年', '工程'], how='left') \
-                                        .merge(avg_checkers_df, on=['学年', '工程'], how='left')
-            num_fillna_inplace(df_performance, 0)
-            if '総工程数' in df_performance.columns:
-                df_performance['総工程数'] = df_performance['総工程数'].astype(int)
-            df_performance = df_performance.round(1)
-            df_performance['学年'] = pd.Categorical(df_performance['学年'], categories=selected_grades, ordered=True)
-            df_performance['工程'] = pd.Categorical(df_performance['工程'], categories=active_processes, ordered=True)
-            df_performance = df_performance.sort_values(by=['学年', '工程'])
-
-    if processes_for_tabs:
-        process_tabs = st.tabs(processes_for_tabs)
-        for i, process_name in enumerate(processes_for_tabs):
-            with process_tabs[i]:
-                df_proc = df_filtered[df_filtered.get('工程') == process_name].copy() \
-                    if '工程' in df_filtered.columns else pd.DataFrame()
-                df_proc_sei = df_seisakubutsu_filtered[df_seisakubutsu_filtered.get('工程') == process_name].copy() \
-                    if '工程' in df_seisakubutsu_filtered.columns else pd.DataFrame()
-
-                if df_proc.empty:
-                    st.info("この工程に関するデータはありません。")
-                    continue
-
                 st.subheader("パフォーマンス・ベンチマーキング")
                 if not df_performance.empty:
                     view = df_performance[df_performance['工程'] == process_name]
@@ -490,64 +732,41 @@ if uploaded_seisakubutsu_file is not None and uploaded_header_file is not None:
                 st.subheader("詳細分析")
 
                 # 手戻り判定フラグ（参考）
-                rework_defs = [p for p in original_process_order if
+                rework_defs = [p for p in PROCESS_ORDER if
                                ('再校' in p or '念校' in p or '色校' in p or 'α' in p or 'β' in p)]
                 if '工程' in df_proc_sei.columns:
                     df_proc_sei['手戻り'] = df_proc_sei['工程'].isin(rework_defs)
 
                 st.markdown("**学年別の『次回チェック出し』状況**")
                 if grade_cols and not df_proc_sei.empty:
-                    melted_cur = df_proc_sei.melt(id_vars=['トークン'], value_vars=grade_cols,
-                                                  var_name='学年', value_name='対象')
-                    if not melted_cur.empty:
-                        melted_cur['対象_bool'] = melted_cur['対象'].map(to_bool_like)
-                        rel_cur = melted_cur[melted_cur['対象_bool'] == True]
-                    else:
-                        rel_cur = pd.DataFrame(columns=['トークン', '学年'])
-
-                    df_next = pd.merge(df_proc, rel_cur[['トークン', '学年']].drop_duplicates(),
-                                       on='トークン', how='left') if not rel_cur.empty else pd.DataFrame(columns=['学年','次回チェック出し'])
-
-                    scaffold_grades_df = pd.DataFrame({'学年': selected_grades})
-                    if not df_next.empty and '学年' in df_next.columns and '次回チェック出し' in df_next.columns:
-                        # 次回チェック出しも真偽値解釈してから集計
-                        next_mask = safe_bool_series(df_next, '次回チェック出し')
-                        count = next_mask.groupby(df_next['学年'], observed=True).sum().astype(int).rename('次回チェック出し要_人数')
-                        total_in_group = df_next.groupby('学年', observed=True).size()
-                        ratio = ((count / total_in_group) * 100).round(1).rename('次回チェック出し要_割合(%)')
-                        result_df = pd.concat([count, ratio], axis=1).reset_index()
-                    else:
-                        result_df = pd.DataFrame(columns=['学年', '次回チェック出し要_人数', '次回チェック出し要_割合(%)'])
-
-                    # 数値列のみNA埋め
-                    num_fillna_inplace(result_df, 0)
+                    result_df = next_check_table(df_proc, df_proc_sei, grade_bits_all.reindex(df_proc_sei.index).to_numpy(),
+                                                 grade_cols, selected_grades)
                     if not result_df.empty:
-                        result_df['次回チェック出し要_人数'] = result_df['次回チェック出し要_人数'].astype(int)
-                        result_df['学年'] = pd.Categorical(result_df['学年'], categories=selected_grades, ordered=True)
-                        result_df = result_df.sort_values(by='学年')
-
-                        fig_ratio = px.bar(result_df, x='学年', y='次回チェック出し要_割合(%)',
-                                           title='学年別「次回チェック出し要」の割合', text_auto='.1f', color='学年')
-                        fig_ratio.update_layout(showlegend=False, xaxis_title=None)
-                        st.plotly_chart(fig_ratio, use_container_width=True, key=f"ratio_chart_{process_name}")
-
-                        fig_count = px.bar(result_df, x='学年', y='次回チェック出し要_人数',
-                                           title='学年別「次回チェック出し要」の人数', text_auto=True, color='学年')
-                        fig_count.update_layout(showlegend=False, xaxis_title=None)
-                        st.plotly_chart(fig_count, use_container_width=True, key=f"count_chart_{process_name}")
+                        # 割合・人数は1つの図にまとめて送る
+                        st.plotly_chart(cached_figure(next_check_figure, result_df), use_container_width=True,
+                                        key=f"next_check_chart_{process_name}")
                     else:
                         st.info("「次回チェック出し」のデータがありません。")
                 else:
                     st.info("学年列が存在しないため、次回チェック出し状況は表示できません。")
-    else:
-        st.info("選択された条件に該当する工程データがありません。")
+        else:
+            st.info("選択された条件に該当する工程データがありません。")
+        if processes_for_tabs:
+            mark(trace, f"工程タブ: {process_name}", rows=len(df_proc))
+        show_profile(trace)
 
-    # 後処理（大きなDFを解放）
-    del df_merged_all, df_seisakubutsu_all
-    del df_filtered_by_date, df_seisakubutsu_filtered_by_date
-    del df_filtered_by_month, df_seisakubutsu_filtered_by_month
-    del df_filtered, df_seisakubutsu_filtered
-    gc.collect()
+        # 後処理（大きなDFを解放）
+        del df_merged_all, df_seisakubutsu_all
+        del df_merged_win, df_seisakubutsu_win, merged_mask, sei_mask
+        del df_filtered, df_seisakubutsu_filtered
+        gc.collect()
 
-else:
-    st.info("サイドバーから分析対象のCSVファイルを2つアップロードすると、分析が始まります。")
+    else:
+        # アップロードが外されたらキャッシュも破棄（共有データの参照も外す）
+        release_shared()
+        for key in (CACHE_STATE_KEY, CACHE_UPLOAD_KEY, CACHE_DIGESTS_KEY, FIGURE_CACHE_KEY):
+            st.session_state.pop(key, None)
+        st.info("サイドバーから分析対象のCSVファイルを2つ（または前処理済みスナップショット）アップロードすると、分析が始まります。")
+finally:
+    finish_trace(trace)
+    st.session_state.pop(PROFILE_TRACE_KEY, None)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+段階ごとの性能計測（Streamlitに依存しない・任意で有効化）
+- mark(trace, 段階名) を処理の区切りごとに呼ぶと、前回の区切りからの経過時間・行数・メモリを記録する
+- メモリは tracemalloc のピーク（区切りごとにリセット）と、指定したDataFrameの deep 使用量、プロセスのRSS
+- 無効時は trace=None のまま mark を呼んでよい（何もしない）
+- tracemalloc はプロセスに1つなので、計測中の trace を数え、最後の1つが終わったときに止める
+  （finish_trace は何度呼んでもよい。他のセッションの計測を止めない）
+"""
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+PROFILE_ENV = 'BPR_PROFILE'  # 1 / true で既定を有効にする
+TRACE_COLS = ['stage', 'wall_ms', 'rows', 'peak_mb', 'deep_mb', 'rss_mb']
+
+_lock = threading.Lock()
+_active = 0             # 計測中（finish_trace 前）の trace の数
+_owns_tracing = False   # tracemalloc をここで開始したか（外で開始されていれば止めない）
+
+def profile_enabled_by_env() -> bool:
+    return os.environ.get(PROFILE_ENV, '').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+def _rss_mb() -> float:
+    """現在のRSS（取れない環境では最大RSS）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2**20 if sys.platform == 'darwin' else rss / 1024
+
+def start_trace() -> dict:
+    """計測を開始する（tracemalloc は計測中の trace が1つでもある間だけ有効）"""
+    global _active, _owns_tracing
+    with _lock:
+        if _active == 0:
+            _owns_tracing = not tracemalloc.is_tracing()
+            if _owns_tracing:
+                tracemalloc.start()
+        _active += 1
+        tracemalloc.reset_peak()
+    now = time.perf_counter()
+    return {'started_at': datetime.now().isoformat(timespec='seconds'), 't0': now, 'last': now, 'stages': [],
+            'open': True}
+
+def mark(trace, stage: str, rows=None, frame=None):
+    """前回の区切りから今までを1段階として記録する（frame を渡すとその deep 使用量も記録）"""
+    if trace is None:
+        return
+    now = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    trace['stages'].append({
+        'stage': stage,
+        'wall_ms': (now - trace['last']) * 1000,
+        'rows': None if rows is None else int(rows),
+        'peak_mb': peak / 2**20,
+        'deep_mb': None if frame is None else frame.memory_usage(deep=True).sum() / 2**20,
+        'rss_mb': _rss_mb(),
+    })
+    tracemalloc.reset_peak()
+    # 計測自体の時間は次の段階に含めない
+    trace['last'] = time.perf_counter()
+
+def finish_trace(trace):
+    """計測を終了する（終了済み・None なら何もしない）。他に計測中の trace が無ければ tracemalloc を止める"""
+    global _active
+    if trace is None or not trace.get('open'):
+        return
+    trace['open'] = False
+    trace['total_ms'] = (time.perf_counter() - trace['t0']) * 1000
+    with _lock:
+        _active -= 1
+        if _active == 0 and _owns_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+def trace_frame(trace) -> pd.DataFrame:
+    """記録を表にする（1行1段階）"""
+    return pd.DataFrame(trace['stages'], columns=TRACE_COLS)
+
+def trace_json(trace) -> bytes:
+    """記録をJSONにする（別の実行・版との比較用）"""
+    payload = {
+        'started_at': trace['started_at'],
+        'total_ms': trace.get('total_ms'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'stages': trace['stages'],
+    }
+    return json.dumps(payload, ensure_ascii=False, indent=1).encode('utf-8')
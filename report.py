@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+バッチレポート（Streamlitに依存しない）
+- 画面と同じ集計表（学年別サマリー・発刊月の推移・工程別指標・次回チェック出し状況）とグラフ（charts.py）を作る
+- 年度×発刊月（および年度ごとの全月）の区分ごとに表（CSV/Parquet）とグラフ（HTML）を書き出す
+- 区分はプロセスプールで並列に処理する
+
+    python report.py 制作物一覧.csv ヘッダー一覧.csv -o report_out [--format csv|parquet] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from analytics import (ROW_ATTR_COLS, build_grade_bits, grade_pairs, monthly_table, next_check_table,
+                       performance_table, row_source, summary_table)
+from charts import monthly_figures, next_check_figure
+from ingest import HAS_PYARROW, MONTH_ORDER, PROCESS_ORDER, SEI_ROW_COL, is_grade_col, join_seisakubutsu, load_tables
+
+ALL_MONTHS = 'すべて'
+PLOTLY_JS = 'plotly.min.js'  # 出力先直下に1つだけ置き、各HTMLから相対参照する
+
+# --- 区分ごとの集計 ---
+
+def partition_tables(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, grade_cols) -> dict:
+    """
+    1区分（絞り込み済みの2テーブル）の集計表。全学年を対象にする。
+    merged_df には ROW_ATTR_COLS を付けておく（iter_partitions が付ける）。
+    戻り値: {'summary', 'monthly', 'performance', 'next_check'}（該当データが無い表は空）
+    """
+    bits = build_grade_bits(seisakubutsu_df, grade_cols).to_numpy()
+    relevant_grades = grade_pairs(seisakubutsu_df['トークン'].to_numpy(), bits, grade_cols)
+    empty = pd.DataFrame()
+    if merged_df.empty or relevant_grades.empty:
+        return {'summary': empty, 'monthly': empty, 'performance': empty, 'next_check': empty}
+    source = row_source(merged_df, seisakubutsu_df, relevant_grades)
+    grades = source['grades']
+    processes = [p for p in PROCESS_ORDER if '工程' in merged_df.columns and p in merged_df['工程'].unique()]
+
+    next_check = []
+    for process in processes:
+        in_process = (seisakubutsu_df['工程'] == process).to_numpy(dtype=bool, na_value=False)
+        table = next_check_table(merged_df[(merged_df['工程'] == process).to_numpy(dtype=bool, na_value=False)],
+                                 seisakubutsu_df[in_process], bits[in_process], grade_cols, grades)
+        if not table.empty:
+            next_check.append(table.assign(工程=process))
+    return {
+        'summary': summary_table(source),
+        'monthly': monthly_table(source) if '発刊月' in seisakubutsu_df.columns else empty,
+        'performance': performance_table(source, grades, processes) if processes else empty,
+        'next_check': pd.concat(next_check, ignore_index=True) if next_check else empty,
+    }
+
+def _write_table(df: pd.DataFrame, path_base: str, fmt: str) -> str:
+    """表を1つ書き出す（CSVは画面のダウンロードと同じUTF-8-SIG）"""
+    if fmt == 'parquet':
+        path = f"{path_base}.parquet"
+        out = df.copy()
+        for col in out.select_dtypes(include=['category']).columns:
+            out[col] = out[col].astype(str)
+        out.to_parquet(path, engine='pyarrow', index=False)
+    else:
+        path = f"{path_base}.csv"
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    return path
+
+def _write_figures(figures, path: str, title: str):
+    """グラフをまとめて1つのHTMLにする（plotly.js は出力先直下のファイルを参照）"""
+    body = ''.join(fig.to_html(full_html=False, include_plotlyjs=False) for fig in figures)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>'
+                f'<script src="../{PLOTLY_JS}"></script></head><body><h1>{title}</h1>{body}</body></html>')
+
+def render_partition(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, grade_cols,
+                     out_dir: str, label: str, fmt: str = 'csv'):
+    """
+    1区分の表とグラフを out_dir/label/ に書き出す（プロセスプールのワーカーで実行）。
+    戻り値: (label, 書き出したファイル数, 秒)
+    """
+    t0 = time.perf_counter()
+    tables = partition_tables(merged_df, seisakubutsu_df, grade_cols)
+    part_dir = os.path.join(out_dir, label)
+    os.makedirs(part_dir, exist_ok=True)
+    n_files = 0
+    for name, df in tables.items():
+        if not df.empty:
+            _write_table(df, os.path.join(part_dir, name), fmt)
+            n_files += 1
+    if not tables['monthly'].empty:
+        _write_figures(monthly_figures(tables['monthly']), os.path.join(part_dir, 'monthly.html'),
+                       f"{label} 発刊月ごとの推移")
+        n_files += 1
+    if not tables['next_check'].empty:
+        figures = []
+        for process, table in tables['next_check'].groupby('工程', sort=False):
+            fig = next_check_figure(table)
+            fig.update_layout(title_text=f"{process}: {fig.layout.title.text}")
+            figures.append(fig)
+        _write_figures(figures, os.path.join(part_dir, 'next_check.html'), f"{label} 次回チェック出し状況")
+        n_files += 1
+    return label, n_files, time.perf_counter() - t0
+
+def iter_partitions(merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame):
+    """
+    (ラベル, 結合側, 制作物側) を 年度ごとの全月 → 年度×発刊月 の順に返す。
+    区分は制作物側で選び、結合側は制作物行から同じ区分の行を取って集計に使う制作物側の列を付ける
+    （ワーカーへは区分の行だけを渡す）
+    """
+    rows = merged_df[SEI_ROW_COL].to_numpy()
+
+    def part(s_sel):
+        return join_seisakubutsu(merged_df[s_sel[rows]], seisakubutsu_df, ROW_ATTR_COLS), seisakubutsu_df[s_sel]
+
+    years = sorted(seisakubutsu_df['年度'].dropna().unique().tolist())
+    for year in years:
+        s_year = (seisakubutsu_df['年度'] == year).to_numpy(dtype=bool, na_value=False)
+        yield f"{year}_{ALL_MONTHS}", *part(s_year)
+        present = set(seisakubutsu_df['発刊月'][s_year].dropna().unique())
+        for month in [m for m in MONTH_ORDER if m in present]:
+            s_sel = s_year & (seisakubutsu_df['発刊月'] == month).to_numpy(dtype=bool, na_value=False)
+            yield f"{year}_{month}", *part(s_sel)
+
+def run_report(seisakubutsu_path: str, header_path: str, out_dir: str, fmt: str = 'csv',
+               workers=None, stream_header: bool = False, log=print):
+    """2つのCSVから全区分のレポートを書き出す。戻り値: 区分ごとの (ラベル, ファイル数, 秒) のリスト"""
+    if fmt == 'parquet' and not HAS_PYARROW:
+        raise RuntimeError("Parquetでの書き出しには pyarrow が必要です。")
+    with open(seisakubutsu_path, 'rb') as f:
+        seisakubutsu_data = f.read()
+    with open(header_path, 'rb') as f:
+        header_data = f.read()
+    merged_df, seisakubutsu_df, _, _ = load_tables(seisakubutsu_data, header_data, stream_header=stream_header)
+    del seisakubutsu_data, header_data
+    if not {'年度', '発刊月'}.issubset(seisakubutsu_df.columns):
+        raise ValueError("年度・発刊月の列が必要です。")
+    grade_cols = [c for c in seisakubutsu_df.columns if is_grade_col(c)]
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, PLOTLY_JS), 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_partition, m, s, grade_cols, out_dir, label, fmt)
+                   for label, m, s in iter_partitions(merged_df, seisakubutsu_df)]
+        for future in as_completed(futures):
+            label, n_files, seconds = future.result()
+            log(f"{label}: {n_files} ファイル（{seconds:.2f} 秒）")
+            results.append((label, n_files, seconds))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="社内チェック業務 BPR分析のバッチレポートを書き出す")
+    parser.add_argument('seisakubutsu_csv', help="制作物一覧 CSV")
+    parser.add_argument('header_csv', help="ヘッダー一覧 CSV")
+    parser.add_argument('-o', '--out', default='report_out', help="出力先ディレクトリ（既定: report_out）")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="表の形式（既定: csv）")
+    parser.add_argument('--workers', type=int, default=None, help="並列プロセス数（既定: CPUコア数）")
+    parser.add_argument('--stream-header', action='store_true', help="ヘッダーCSVを分割読み込みする（大容量向け）")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    try:
+        results = run_report(args.seisakubutsu_csv, args.header_csv, args.out, fmt=args.format,
+                             workers=args.workers, stream_header=args.stream_header)
+    except (ValueError, RuntimeError) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    n_files = sum(r[1] for r in results)
+    print(f"{len(results)} 区分・{n_files} ファイルを {args.out} に書き出しました（{time.perf_counter() - t0:.1f} 秒）")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
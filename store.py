@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+共有データセットストア（Streamlitに依存しない・任意で有効化）
+- 前処理済み（PII除去済み）の2テーブルを、サーバー上の Arrow IPC ファイル（Feather v2・無圧縮）として公開する。
+  キーはアップロード内容のハッシュなので、同じファイルをアップロードしたセッションだけが同じデータを開く
+- 読み込みはメモリマップ。数値・フラグ・日付・カテゴリのコードはファイル上のページをそのまま参照し
+  （コピーしない）、セッションごとに作るのは列を束ねるDataFrameの枠だけ。書き込みは pandas 3 の Copy-on-Write で
+  各セッション側に複製される（Copy-on-Write が無効な pandas では、開くときに列をセッション側へコピーする）
+- 参照はセッションごとのリース（最終アクセスから STORE_LEASE_SEC）として数え、参照の無いデータはマップを外す。
+  ファイルは件数・容量の上限を超えたら、参照の無いものを最終アクセスが古い順に削除する
+- 学年ビットマスクなどデータから導く索引も、同じデータを開くセッション間で共有できる（shared_derived）
+- 登録簿はプロセス単位。複数プロセスでも同じファイルのページはOSのページキャッシュで共有される
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+STORE_DIR_ENV = 'BPR_STORE_DIR'     # 既定: 一時ディレクトリ/bpr_store
+STORE_ENABLE_ENV = 'BPR_SHARED_STORE'  # 1 / true で画面の既定を有効にする
+STORE_FORMAT_VERSION = 2  # 2: 結合側はヘッダー側の列と制作物行のみ
+STORE_TABLES = ('merged', 'seisakubutsu')
+STORE_META = 'meta.json'
+STORE_MAX_ENTRIES = 4
+STORE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+STORE_LEASE_SEC = 30 * 60           # セッションの参照の有効期限（最終アクセスから）
+
+_lock = threading.Lock()
+_registry = {}  # digest -> {'columns': {表名: {列名: 配列}}, 'meta': dict, 'owners': {owner: 最終アクセス}}
+
+def shared_store_enabled_by_env() -> bool:
+    return os.environ.get(STORE_ENABLE_ENV, '').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+def store_dir() -> str:
+    path = os.environ.get(STORE_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'bpr_store')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _entry_dir(digest: str) -> str:
+    return os.path.join(store_dir(), f"v{STORE_FORMAT_VERSION}_{digest}")
+
+# --- 書き出し（列をメモリマップでそのまま参照できる形にする） ---
+
+def _encode_column(s: pd.Series):
+    """
+    1列を (Arrow配列, 復元情報) にする。
+    カテゴリはコード（pandasと同じ整数幅）、フラグは uint8、日付は int64（NaTも値のまま）にして
+    欠損ビットマップの無いプリミティブ配列にする。それ以外の列は通常のArrow変換（読み込み時にコピー）。
+    """
+    dtype = s.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = dtype.categories
+        if categories.dtype.kind in 'iuf' or pd.api.types.is_string_dtype(categories.dtype):
+            info = {'kind': 'category', 'categories': categories.tolist(),
+                    'categories_dtype': str(categories.dtype), 'ordered': bool(dtype.ordered)}
+            return pa.array(s.cat.codes.to_numpy()), info
+    elif dtype == np.bool_:
+        return pa.array(s.to_numpy().view(np.uint8)), {'kind': 'bool'}
+    elif isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        return pa.array(s.to_numpy().view(np.int64)), {'kind': 'datetime', 'dtype': str(dtype)}
+    elif isinstance(dtype, np.dtype) and dtype.kind in 'iuf':
+        return pa.array(s.to_numpy()), {'kind': 'plain'}
+    return pa.array(s, from_pandas=True), {'kind': 'arrow'}
+
+def _write_table(df: pd.DataFrame, path: str) -> dict:
+    """1テーブルを1バッチのArrow IPCファイルに書く（列が分割されないのでゼロコピーで読める）。戻り値: 列の復元情報"""
+    arrays, infos = [], {}
+    for col in df.columns:
+        array, infos[col] = _encode_column(df[col])
+        arrays.append(array)
+    table = pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(len(df), 1))
+    return infos
+
+def publish_dataset(digest: str, merged_df: pd.DataFrame, seisakubutsu_df: pd.DataFrame, meta=None) -> bool:
+    """
+    2テーブルをストアに公開する（既にあれば何もしない）。一時ディレクトリに書いてから置き換えるので、
+    他のセッション・プロセスが書きかけを開くことはない。戻り値: 新しく公開したか
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError("共有データの公開には pyarrow が必要です。")
+    final = _entry_dir(digest)
+    if os.path.isdir(final):
+        return False
+    tmp = tempfile.mkdtemp(prefix='.publish_', dir=store_dir())
+    try:
+        columns = {name: _write_table(df, os.path.join(tmp, f"{name}.arrow"))
+                   for name, df in zip(STORE_TABLES, (merged_df, seisakubutsu_df))}
+        with open(os.path.join(tmp, STORE_META), 'w', encoding='utf-8') as f:
+            json.dump({'format_version': STORE_FORMAT_VERSION, 'columns': columns, 'meta': meta or {}},
+                      f, ensure_ascii=False)
+        try:
+            os.replace(tmp, final)
+        except OSError:
+            return False  # 同時に公開された
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+    return True
+
+# --- 読み込み（メモリマップ） ---
+
+def _decode_column(array, info: dict):
+    """_encode_column の逆。プリミティブ配列はファイル上のページを参照する配列を返す"""
+    kind = info['kind']
+    if kind == 'arrow':
+        return array.to_pandas()
+    values = array.to_numpy(zero_copy_only=True)
+    if kind == 'category':
+        categories = pd.Index(info['categories'], dtype=info['categories_dtype'])
+        return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories, ordered=info['ordered']),
+                                         validate=False)
+    if kind == 'bool':
+        return values.view(np.bool_)
+    if kind == 'datetime':
+        return values.view(info['dtype'])
+    return values
+
+def _map_entry(digest: str):
+    """ストアのファイルをメモリマップして列ごとの配列にする（無ければ None）"""
+    path = _entry_dir(digest)
+    try:
+        with open(os.path.join(path, STORE_META), encoding='utf-8') as f:
+            stored = json.load(f)
+        columns = {}
+        for name in STORE_TABLES:
+            table = pa.ipc.open_file(pa.memory_map(os.path.join(path, f"{name}.arrow"), 'r')).read_all()
+            infos = stored['columns'][name]
+            columns[name] = {col: _decode_column(table.column(col).chunk(0) if table.num_rows else
+                                                 table.column(col).combine_chunks(), infos[col])
+                             for col in table.column_names}
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+    return {'columns': columns, 'meta': stored.get('meta', {}), 'owners': {}}
+
+def copy_on_write_enabled() -> bool:
+    """pandas の Copy-on-Write が有効か（pandas 3 以降は常に有効）"""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    return pd.get_option('mode.copy_on_write') is True
+
+def _frame(columns: dict) -> pd.DataFrame:
+    """
+    共有の列配列を束ねたDataFrame（列ごとに別ブロックのまま、コピーしない）。
+    Copy-on-Write が無効なら、その場での書き込みが共有のページに届かないよう列をコピーする
+    """
+    copy = not copy_on_write_enabled()
+    return pd.DataFrame({col: pd.Series(values, copy=copy) for col, values in columns.items()}, copy=False)
+
+def acquire_dataset(digest: str, owner: str):
+    """
+    公開済みのデータを owner（セッションの識別子）の参照として開く。
+    戻り値: (merged_df, seisakubutsu_df, 公開時のmeta) または None（未公開・読めない）
+    """
+    if not HAS_PYARROW:
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _registry.get(digest)
+        if entry is None:
+            entry = _map_entry(digest)
+            if entry is None:
+                return None
+            _registry[digest] = entry
+        entry['owners'][owner] = now
+        columns, meta = entry['columns'], entry['meta']
+    try:
+        os.utime(_entry_dir(digest))  # ファイル側の最終アクセス（プロセスをまたいだ削除順に使う）
+    except OSError:
+        pass
+    return _frame(columns['merged']), _frame(columns['seisakubutsu']), meta
+
+def release_dataset(digest: str, owner: str):
+    """owner の参照を外す（参照が無くなればマップを外す）"""
+    with _lock:
+        entry = _registry.get(digest)
+        if entry is not None:
+            entry['owners'].pop(owner, None)
+    evict()
+
+def shared_derived(digest: str, name: str, build):
+    """データから導く値（索引・集計など）を、同じデータを開くセッション間で1つだけ作って共有する"""
+    with _lock:
+        entry = _registry.get(digest)
+        if entry is not None and name in entry.setdefault('derived', {}):
+            return entry['derived'][name]
+    value = build()
+    with _lock:
+        entry = _registry.get(digest)
+        if entry is not None:
+            value = entry.setdefault('derived', {}).setdefault(name, value)
+    return value
+
+# --- 参照数と削除 ---
+
+def _live_owners(entry: dict, now: float) -> int:
+    """リースの切れていない参照数（切れた参照はここで外す）"""
+    for owner in [o for o, t in entry['owners'].items() if now - t > STORE_LEASE_SEC]:
+        del entry['owners'][owner]
+    return len(entry['owners'])
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+def evict():
+    """
+    参照の無いデータのマップを外し、ファイルが件数・容量の上限を超えていれば
+    参照の無いものを最終アクセスが古い順に削除する
+    """
+    now = time.monotonic()
+    with _lock:
+        for digest in [d for d, e in _registry.items() if _live_owners(e, now) == 0]:
+            del _registry[digest]
+        in_use = {_entry_dir(d) for d in _registry}
+    root = store_dir()
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not name.startswith('.'):
+            try:
+                entries.append((os.path.getmtime(path), _dir_bytes(path), path))
+            except OSError:
+                continue
+    total = sum(e[1] for e in entries)
+    count = len(entries)
+    for _, nbytes, path in sorted(entries):
+        if count <= STORE_MAX_ENTRIES and total <= STORE_MAX_BYTES:
+            break
+        if path in in_use:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        count -= 1
+        total -= nbytes
+
+def store_status() -> pd.DataFrame:
+    """ストアの状態（1行1データ: 参照数・ファイルMB・マップ中か）"""
+    now = time.monotonic()
+    with _lock:
+        owners = {d: _live_owners(e, now) for d, e in _registry.items()}
+    root = store_dir()
+    rows = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not name.startswith('.'):
+            digest = name.split('_', 1)[-1]
+            rows.append({'data': digest[:12], 'refs': owners.get(digest, 0), 'file_mb': _dir_bytes(path) / 2**20,
+                         'mapped': digest in owners})
+    return pd.DataFrame(rows, columns=['data', 'refs', 'file_mb', 'mapped'])